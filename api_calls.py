@@ -1,12 +1,44 @@
 from config import BASE_URL
+from urllib.parse import quote
+import json
+import time
 import requests
 import streamlit as st
 
 
 # Notes API calls
-def fetch_notes():
-    response = requests.get(f"{BASE_URL}/notes")
-    return response.json() if response.status_code == 200 else []
+def fetch_notes(page_size=500):
+    """Fetch the metadata (title, size, mtime, hash) of every note, without bodies."""
+    notes = []
+    cursor = None
+    while True:
+        params = {"limit": page_size}
+        if cursor:
+            params["cursor"] = cursor
+        response = requests.get(f"{BASE_URL}/notes/metadata", params=params)
+        if response.status_code != 200:
+            return notes
+        page = response.json()
+        notes.extend(page["notes"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            return notes
+
+def fetch_note(title):
+    response = requests.get(f"{BASE_URL}/notes/{quote(title, safe='')}")
+    return response.json() if response.status_code == 200 else None
+
+def search_notes(query, k=10):
+    response = requests.get(f"{BASE_URL}/notes/search", params={"q": query, "k": k})
+    return response.json()["results"] if response.status_code == 200 else []
+
+def stream_notes():
+    """Yield every note with its content, one at a time, from the NDJSON export."""
+    with requests.get(f"{BASE_URL}/notes/export", stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if line:
+                yield json.loads(line)
 
 def save_note(title, content):
     response = requests.post(f"{BASE_URL}/notes", params={"title": title, "content": content})
@@ -27,10 +59,65 @@ def load_question(note_title):
         raise Exception(f"Error fetching questions: {response.status_code} - {response.text}")
     return response.json()
 
-def generate_questions(note_tile, note_content):
-    response = requests.post(f"{BASE_URL}/questions", json={"note_title": note_tile, "note_content": note_content})
+def submit_question_job(note_title, note_content, force=False):
+    response = requests.post(f"{BASE_URL}/questions", json={"note_title": note_title, "note_content": note_content, "force": force})
+    return response.json()["job_id"]
+
+def get_question_job(job_id):
+    response = requests.get(f"{BASE_URL}/questions/jobs/{job_id}")
     return response.json()
 
+def generate_questions(note_tile, note_content, force=False, poll_interval=1.0, timeout=600):
+    """Submit a generation job and poll it until it finishes; returns the questions, or [] on failure."""
+    job_id = submit_question_job(note_tile, note_content, force)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_question_job(job_id)
+        if job["status"] == "done":
+            return job["result"]
+        if job["status"] == "failed":
+            return []
+        time.sleep(poll_interval)
+    return []
+
+def stream_questions(note_title, note_content, force=False):
+    """Yield the generated questions one by one from the server-sent event stream."""
+    with requests.post(f"{BASE_URL}/questions/stream", json={"note_title": note_title, "note_content": note_content, "force": force}, stream=True) as response:
+        response.raise_for_status()
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "question":
+                    yield data
+                elif event == "error":
+                    raise Exception(data["detail"])
+
+def get_due_questions(note_title=None, limit=20):
+    params = {"limit": limit}
+    if note_title:
+        params["note_title"] = note_title
+    response = requests.get(f"{BASE_URL}/quiz/due", params=params)
+    response.raise_for_status()
+    return response.json()["questions"]
+
+def sample_questions(note_title, size=10, min_mean=None, max_mean=None):
+    params = {"note_title": note_title, "size": size}
+    if min_mean is not None:
+        params["min_mean"] = min_mean
+    if max_mean is not None:
+        params["max_mean"] = max_mean
+    response = requests.get(f"{BASE_URL}/quiz/sample", params=params)
+    response.raise_for_status()
+    return response.json()["questions"]
+
+def get_question_difficulty(note_title, order="hardest", limit=10, min_attempts=1):
+    response = requests.get(f"{BASE_URL}/stats/questions", params={"note_title": note_title, "order": order, "limit": limit, "min_attempts": min_attempts})
+    response.raise_for_status()
+    return response.json()["questions"]
+
 def update_questions_file(new_question, note_title):
     response = requests.put(f"{BASE_URL}/questions", params={"new_questions": new_question, "note_title": note_title})
     return response.json()
@@ -45,23 +132,46 @@ def evaluate_answer(question_text, user_answer, question_response):
     response = requests.get(f"{BASE_URL}/answers", params={"question_text": question_text, "user_answer": user_answer, "question_response": question_response})
     return response.json()
 
+def evaluate_answers(answers):
+    """Grade a whole quiz in one request; answers are {question, user_answer, correct_answer} dicts."""
+    response = requests.post(f"{BASE_URL}/answers/batch", json={"answers": answers})
+    if response.status_code in (502, 503):
+        raise Exception(response.json()["detail"])
+    response.raise_for_status()
+    return response.json()["evaluations"]
+
 def save_quiz_result(note_title, question_text, user_answer, question_response, evaluation_score):
     response = requests.post(f"{BASE_URL}/answers", params={"note_title": note_title, "question_text": question_text, 
                                                             "user_answer": user_answer, "question_response": question_response, 
                                                             "evaluation_score": evaluation_score})
     return response.json()
 
+def save_quiz_results(note_title, results):
+    response = requests.post(f"{BASE_URL}/answers/batch-save", json={"note_title": note_title, "results": results})
+    response.raise_for_status()
+    return response.json()
+
 
 # Stats/Performances API calls
 def get_all_stats():
     response = requests.get(f"{BASE_URL}/performances")
     return response.json() 
 
-def compute_overall_performance(stats):
-    response = requests.get(f"{BASE_URL}/stats", json={"stats": stats})
-    data = response.json()
-    print("API Response:", data) 
-    return data["all_scores"], data["notes_avg_scores"]
+def get_note_attempts(note_title, cursor=None, limit=20):
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    response = requests.get(f"{BASE_URL}/performances/{quote(note_title, safe='')}/attempts", params=params)
+    return response.json()
+
+def get_stats_analytics(note_title=None):
+    params = {"note_title": note_title} if note_title else {}
+    response = requests.get(f"{BASE_URL}/stats/analytics", params=params)
+    return response.json()
+
+def get_stats_summary():
+    response = requests.get(f"{BASE_URL}/stats/summary")
+    return response.json()
 
 def delete_note_stats(note_title):
     response = requests.delete(f"{BASE_URL}/performances", params={"note_title": note_title})
@@ -8,7 +8,7 @@ st.set_page_config(
 
 import os, json
 from utils.note_manager import load_notes, save_note, delete_note, update_note
-from utils.question_generator import generate_questions, evaluate_answer
+from utils.question_generator import generate_questions, evaluate_answer, EvaluationError
 from config import QUESTIONS_DIR
 from utils.stats_manager import get_all_stats, save_quiz_result, delete_note_stats, delete_all_stats
 
@@ -186,11 +186,15 @@ elif menu == "Quiz Mode":
                         user_answer = st.session_state.user_answers.get(answer_key, "")
                         
                         # Evaluating the response
-                        evaluation = evaluate_answer(
-                            question['text'],
-                            user_answer,
-                            question['reponse']
-                        )
+                        try:
+                            evaluation = evaluate_answer(
+                                question['text'],
+                                user_answer,
+                                question['reponse']
+                            )
+                        except EvaluationError as e:
+                            st.error(f"Answers could not be assessed, please try again later: {e}")
+                            st.stop()
                         
                         # Save result
                         save_quiz_result(
@@ -28,3 +28,85 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 STATS_DIR = "./stats/"
 if not os.path.exists(STATS_DIR):
     os.makedirs(STATS_DIR)
+
+# Storage engine for notes, questions and stats: "filesystem" or "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "filesystem")
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "./db/notemaster.sqlite3")
+# Seconds between two compactions of the filesystem attempt logs
+STATS_COMPACTION_INTERVAL = float(os.getenv("STATS_COMPACTION_INTERVAL", "300"))
+# Quiz results are gathered for this many seconds, logged to STATS_WAL_DIR then written in one go
+STATS_GROUP_COMMIT_INTERVAL = float(os.getenv("STATS_GROUP_COMMIT_INTERVAL", "0.05"))
+STATS_WAL_DIR = os.getenv("STATS_WAL_DIR", "./db/attempts_wal/")
+# Views derived from the attempt history (score aggregates, spaced-repetition cards, per-question score
+# statistics) with the position each note was read up to, reconciled with the storage at startup and
+# every STATS_VIEWS_RECONCILE_INTERVAL seconds
+STATS_VIEWS_PATH = os.getenv("STATS_VIEWS_PATH", "./db/stats_views.sqlite3")
+STATS_VIEWS_RECONCILE_INTERVAL = float(os.getenv("STATS_VIEWS_RECONCILE_INTERVAL", "300"))
+# Last N scores of each note kept by the summary served by GET /stats/summary
+STATS_LAST_N = int(os.getenv("STATS_LAST_N", "10"))
+
+# On-disk inverted index used by note search
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "./db/search_index.sqlite3")
+
+# LLM used for question generation and answer evaluation
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek/deepseek-chat")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://openrouter.ai/api/v1")
+# "live" calls the provider, "record" also writes each request/response pair to LLM_CASSETTE_DIR,
+# "replay" serves the recorded cassettes offline after LLM_REPLAY_LATENCY seconds
+# ("recorded" to reproduce the recorded latency) varied by +/- LLM_REPLAY_JITTER
+LLM_MODE = os.getenv("LLM_MODE", "live")
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "./db/cassettes/")
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0")
+LLM_REPLAY_JITTER = float(os.getenv("LLM_REPLAY_JITTER", "0"))
+# Maximum number of concurrent LLM calls in the process and per-attempt timeout in seconds
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Provider quota: sustained requests per second and burst size of the token bucket
+LLM_RATE_LIMIT = float(os.getenv("LLM_RATE_LIMIT", "5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+# Retries of rate limited, failed or timed out calls, with jittered exponential backoff (seconds)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+# Consecutive upstream failures that open the circuit, and seconds before a probe call is let through
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Total budget of a request in seconds, queueing and retries included:
+# interactive calls (grading, streamed generation) and bulk calls (background generation)
+LLM_INTERACTIVE_DEADLINE = float(os.getenv("LLM_INTERACTIVE_DEADLINE", "60"))
+LLM_BULK_DEADLINE = float(os.getenv("LLM_BULK_DEADLINE", "600"))
+# Bump when the generation prompt changes so cached questions are not reused
+GENERATION_PROMPT_VERSION = "1"
+
+# Persistent cache of generated questions, keyed by note content, model and prompt version
+GENERATION_CACHE_PATH = os.getenv("GENERATION_CACHE_PATH", "./db/generation_cache.sqlite3")
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "1000"))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Notes longer than GENERATION_CHUNK_TOKENS (estimated) are split into sections whose questions
+# are generated in parallel, at most GENERATION_CHUNK_CONCURRENCY sections at a time per note
+GENERATION_CHUNK_TOKENS = int(os.getenv("GENERATION_CHUNK_TOKENS", "3000"))
+GENERATION_CHUNK_CONCURRENCY = int(os.getenv("GENERATION_CHUNK_CONCURRENCY", "8"))
+
+# Persistent cache of answer evaluations, keyed by the normalized question and answers
+EVALUATION_CACHE_PATH = os.getenv("EVALUATION_CACHE_PATH", "./db/evaluation_cache.sqlite3")
+EVALUATION_CACHE_MAX_ENTRIES = int(os.getenv("EVALUATION_CACHE_MAX_ENTRIES", "100000"))
+EVALUATION_CACHE_TTL = int(os.getenv("EVALUATION_CACHE_TTL", str(30 * 24 * 3600)))
+EVALUATION_CACHE_MEMORY_ENTRIES = int(os.getenv("EVALUATION_CACHE_MEMORY_ENTRIES", "10000"))
+
+# Local lexical pre-scorer: answers whose similarity to the reference is outside
+# [PRESCORER_LOW, PRESCORER_HIGH] are graded without calling the LLM.
+# Recalibrate with: python -m scripts.calibrate_prescorer
+PRESCORER_ENABLED = os.getenv("PRESCORER_ENABLED", "1") == "1"
+PRESCORER_LOW = float(os.getenv("PRESCORER_LOW", "0.05"))
+PRESCORER_HIGH = float(os.getenv("PRESCORER_HIGH", "0.9"))
+# Weights of token overlap, keyword recall and character n-gram similarity
+PRESCORER_WEIGHTS = (0.25, 0.45, 0.30)
+
+# Budget of a single batch grading prompt; larger quizzes are split into several calls
+EVALUATION_BATCH_MAX_CHARS = int(os.getenv("EVALUATION_BATCH_MAX_CHARS", "24000"))
+EVALUATION_BATCH_MAX_ITEMS = int(os.getenv("EVALUATION_BATCH_MAX_ITEMS", "25"))
+
+# Background jobs (question generation)
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "./db/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
@@ -1,16 +1,31 @@
 from fastapi import FastAPI, HTTPException, Depends, Query, Form, Body
+from fastapi.responses import StreamingResponse, JSONResponse, FileResponse
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import List, Dict
 import os
 import json
+import tempfile
+import logging
+import concurrent.futures
 import jwt
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
-from config import QUESTIONS_DIR, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, USER_DB_DIR
-from utils.note_manager import load_notes, save_note, delete_note, update_note
-from utils.question_generator import generate_questions, evaluate_answer, load_question, update_questions, delete_all_questions
-from utils.stats_manager import get_all_stats, save_quiz_result, delete_note_stats, delete_all_stats
+from config import QUESTIONS_DIR, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, USER_DB_DIR, JOBS_DB_PATH, JOB_WORKERS
+from utils.note_manager import load_notes, save_note, delete_note, update_note, get_cache_stats, list_notes_metadata, get_note, iter_notes
+from utils.question_generator import generation_cache, generation_flights, generation_flight_key, evaluation_cache, run_generation_job, run_regeneration_job, astream_questions, EvaluationError, aevaluate_answer, aevaluate_answers, load_question, update_questions, delete_all_questions
+from utils.job_queue import JobQueue
+from utils.llm_client import get_llm_stats
+from utils.llm_scheduler import LLMUnavailableError
+from utils.prescorer import get_prescorer_stats
+from utils.search_index import search as search_notes, get_index_stats, start_sync as start_search_index_sync
+from utils.analytics import get_analytics
+from utils.spaced_repetition import get_due_questions
+from utils.question_difficulty import get_question_difficulty, sample_questions, HARDEST
+from utils.stats_export import export_attempts, NPZ, PARQUET
+from utils.stats_views import start_reconciler as start_stats_views_reconciler, stop_reconciler as stop_stats_views_reconciler
+from utils.stats_manager import get_all_stats, get_note_attempts, get_stats_summary, save_quiz_result, save_quiz_results as save_quiz_result_batch, delete_note_stats, delete_all_stats, start_compactor, stop_compactor, attempt_writer
 from models.models import *
 from db.user_db import users_db
 from auth import *
@@ -18,6 +33,39 @@ from auth import *
 
 app = FastAPI()
 
+job_queue = JobQueue(JOBS_DB_PATH, workers=JOB_WORKERS)
+job_queue.register("generate_questions", run_generation_job)
+job_queue.register("regenerate_questions", run_regeneration_job)
+
+
+@app.on_event("startup")
+def start_job_queue():
+    job_queue.start()
+    attempt_writer.start()
+    start_compactor()
+    start_search_index_sync()
+    start_stats_views_reconciler()
+
+
+@app.on_event("shutdown")
+def stop_job_queue():
+    job_queue.stop()
+    attempt_writer.stop()
+    stop_compactor()
+    stop_stats_views_reconciler()
+
+
+@app.exception_handler(LLMUnavailableError)
+def llm_unavailable(request, exc: LLMUnavailableError):
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
+
+
+@app.exception_handler(EvaluationError)
+def evaluation_failed(request, exc: EvaluationError):
+    # Bad gateway: the model answered, but not with a grade that may be saved
+    return JSONResponse(status_code=502, content={"detail": str(exc)})
+
 
 @app.post("/auth/login", response_model=Token)
 def login(request: LoginRequest):
@@ -96,6 +144,32 @@ def get_notes():
     return load_notes()
 
 
+@app.get("/notes/metadata")
+def get_notes_metadata(limit: int = Query(100, ge=1, le=1000), cursor: str = None):
+    return list_notes_metadata(limit=limit, cursor=cursor)
+
+
+@app.get("/notes/search")
+def search_notes_endpoint(q: str, k: int = Query(10, ge=1, le=100)):
+    return search_notes(q, k)
+
+
+@app.get("/notes/export")
+def export_notes():
+    def ndjson_lines():
+        for note in iter_notes():
+            yield json.dumps(note, ensure_ascii=False) + "\n"
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/notes/{title}")
+def get_single_note(title: str):
+    note = get_note(title)
+    if note is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return note
+
+
 @app.post("/notes")
 def create_note(title: str, content: str):
     save_note(title, content)
@@ -104,8 +178,15 @@ def create_note(title: str, content: str):
 
 @app.put("/notes")
 def edit_note(title: str, content: str):
+    previous = get_note(title)
     if update_note(title, content):
-        return {"message": "Note updated successfully"}
+        response = {"message": "Note updated successfully"}
+        # Refresh the questions of the edited paragraphs only
+        if previous is not None and previous["content"] != content and load_question(title):
+            response["questions_job_id"] = job_queue.submit(
+                "regenerate_questions", {"note_title": title, "old_content": previous["content"]}
+            )
+        return response
     raise HTTPException(status_code=400, detail="Error updating note")
 
 
@@ -129,7 +210,34 @@ def get_questions(title: str):
 
 @app.post("/questions")
 def generate_question(request: QuestionRequest):
-    return generate_questions(request.note_title, request.note_content)
+    # Clicks on the same note and content while a job is pending get that job
+    dedupe_key = generation_flight_key(request.note_title, request.note_content, request.force)
+    job_id = job_queue.submit("generate_questions", request.model_dump(), dedupe_key=dedupe_key)
+    return {"job_id": job_id, "status": job_queue.get(job_id)["status"]}
+
+
+@app.post("/questions/stream")
+async def stream_questions(request: QuestionRequest):
+    async def events():
+        count = 0
+        try:
+            async for question in astream_questions(request.note_title, request.note_content, force=request.force):
+                count += 1
+                yield f"event: question\ndata: {json.dumps(question, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logging.error("Error when streaming questions : %s", e)
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'count': count})}\n\n"
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/questions/jobs/{job_id}")
+def get_question_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.put("/questions")
@@ -150,25 +258,61 @@ def delete_questions(note_title):
 
 
 @app.get("/answers")
-def assess_answer(question_text, user_answer, question_response):
-    evaluation = evaluate_answer(question_text, user_answer, question_response)
+async def assess_answer(question_text, user_answer, question_response):
+    evaluation = await aevaluate_answer(question_text, user_answer, question_response)
     if not evaluation:
         raise HTTPException(status_code=500, detail="Failed to assess answers")
     return evaluation
 
 
+@app.post("/answers/batch")
+async def assess_answers(request: BatchAnswerRequest):
+    evaluations = await aevaluate_answers([item.model_dump() for item in request.answers])
+    return {"evaluations": evaluations}
+
+
+# The attempts stay queued in the write-ahead log and may still be saved: retrying could save them twice
+SAVE_TIMEOUT_DETAIL = "The results are taking longer than usual to save, check your history before submitting them again"
+
+
 @app.post("/answers")
 def save_quiz_results(note_title, question_text, user_answer, question_response, evaluation_score):
-
-    save_quiz_result(
-                        note_title,
-                        question_text,
-                        user_answer,
-                        question_response,
-                        evaluation_score
-                    )
+    try:
+        save_quiz_result(
+                            note_title,
+                            question_text,
+                            user_answer,
+                            question_response,
+                            evaluation_score
+                        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except concurrent.futures.TimeoutError:
+        raise HTTPException(status_code=503, detail=SAVE_TIMEOUT_DETAIL)
     return {"message": "Quiz results saved successfully"}
 
+
+@app.post("/answers/batch-save")
+def save_quiz_results_batch(request: BatchSaveRequest):
+    try:
+        saved = save_quiz_result_batch(request.note_title, [item.model_dump() for item in request.results])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except concurrent.futures.TimeoutError:
+        raise HTTPException(status_code=503, detail=SAVE_TIMEOUT_DETAIL)
+    return {"message": "Quiz results saved successfully", "saved": saved}
+
+
+@app.get("/quiz/due")
+def get_due_quiz(note_title: str = None, limit: int = Query(20, ge=1, le=500), include_new: bool = True):
+    return {"questions": get_due_questions(note_title, limit=limit, include_new=include_new)}
+
+
+@app.get("/quiz/sample")
+def sample_quiz(note_title: str, size: int = Query(10, ge=1, le=500), min_mean: float = None, max_mean: float = None):
+    return {"questions": sample_questions(note_title, size=size, min_mean=min_mean, max_mean=max_mean)}
+
+
 # ==============================
 # 📊 STATS / PERFORMANCE
 # ==============================
@@ -178,6 +322,55 @@ def get_all_performance_stats():
     return get_all_stats()
 
 
+@app.get("/performances/{note_title}/attempts")
+def get_note_attempts_page(note_title: str, limit: int = Query(20, ge=1, le=200), cursor: str = None,
+                           since: datetime = None, until: datetime = None):
+    try:
+        return get_note_attempts(note_title, limit=limit, cursor=cursor, since=since, until=until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/stats/analytics")
+def get_performance_analytics(note_title: str = None, window: int = Query(10, ge=1, le=1000),
+                              points: int = Query(50, ge=1, le=1000)):
+    return get_analytics(note_title, window=window, points=points)
+
+
+@app.get("/stats/export")
+def export_performances(since: str = None, format: str = NPZ):
+    # Checked before the format is used in a file name
+    if format not in (NPZ, PARQUET):
+        raise HTTPException(status_code=400, detail=f"Unknown export format: {format}")
+    fd, path = tempfile.mkstemp(suffix=f".{format}")
+    os.close(fd)
+    try:
+        result = export_attempts(path, since=since, file_format=format)
+    except ValueError as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    return FileResponse(
+        path,
+        filename=f"attempts.{format}",
+        media_type="application/octet-stream",
+        headers={"X-Export-Watermark": result["watermark"] or "", "X-Export-Attempts": str(result["attempts"])},
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@app.get("/stats/questions")
+def get_questions_difficulty(note_title: str, order: str = HARDEST, limit: int = Query(10, ge=1, le=500), min_attempts: int = Query(1, ge=1)):
+    try:
+        return {"questions": get_question_difficulty(note_title, order=order, limit=limit, min_attempts=min_attempts)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/stats/summary")
+def get_performance_summary():
+    return get_stats_summary()
+
+
 @app.get("/stats")
 def calculate_overall_performances(stats: StatModel):
     all_scores = []
@@ -201,3 +394,21 @@ def delete_note_stat(note_title):
 def delete_all_stats_performances():
     return delete_all_stats()
 
+
+# ==============================
+# 📈 METRICS
+# ==============================
+
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "note_cache": get_cache_stats(),
+        "search_index": get_index_stats(),
+        "generation_cache": generation_cache.get_stats(),
+        "generation_single_flight": generation_flights.get_stats(),
+        "evaluation_cache": evaluation_cache.get_stats(),
+        "llm": get_llm_stats(),
+        "prescorer": get_prescorer_stats(),
+        "jobs": job_queue.get_stats(),
+        "attempt_writer": attempt_writer.get_stats(),
+    }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple, Union
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -31,6 +31,25 @@ class DeleteAccountRequest(BaseModel):
 class QuestionRequest(BaseModel):
     note_title: str
     note_content: str
+    force: bool = False
+
+class AnswerItem(BaseModel):
+    question: str
+    user_answer: str
+    correct_answer: str
+
+class BatchAnswerRequest(BaseModel):
+    answers: List[AnswerItem]
+
+class QuizResultItem(BaseModel):
+    question: str
+    user_answer: str
+    correct_answer: str
+    score: Union[int, float]
+
+class BatchSaveRequest(BaseModel):
+    note_title: str
+    results: List[QuizResultItem]
 
 class StatModel(BaseModel):
     stats: Dict
\ No newline at end of file
@@ -405,6 +405,21 @@ elif menu == "🗒️ Note-taking":
     if "editing_note" not in st.session_state:
         st.session_state.editing_note = None
 
+    # Full-text search over the notes
+    search_query = st.text_input("🔎 Search notes")
+    if search_query:
+        results = search_notes(search_query) # API call to search notes
+        if results:
+            for result in results:
+                col1, col2 = st.columns([4, 1])
+                with col1:
+                    st.markdown(f"**📝 {result['title']}**  \n{result['snippet']}")
+                with col2:
+                    if st.button("View/Edit", key=f"search_edit_{result['title']}"):
+                        st.session_state.editing_note = fetch_note(result['title'])
+        else:
+            st.info("No note matches your search.")
+
     # Displaying existing notes
 
     st.write("### Your notes :")
@@ -415,7 +430,7 @@ elif menu == "🗒️ Note-taking":
                 st.write(f"📝 {note['title']}")
             with col2:
                 if st.button("View/Edit", key=f"edit_{note['title']}"):
-                    st.session_state.editing_note = note
+                    st.session_state.editing_note = fetch_note(note['title']) # API call to load the note body
             with col3:
                 if st.button("Delete", key=f"delete_{note['title']}"):
                     delete_note(note['title']) # API call to delete the note
@@ -479,22 +494,40 @@ elif menu == "❓Quiz Mode":
     selected_note = st.selectbox("Select a note", note_titles)
 
     if selected_note:
-        note_content = next(note["content"] for note in notes if note["title"] == selected_note)
+        note_content = fetch_note(selected_note)["content"]
         json_file_path = os.path.join(QUESTIONS_DIR, f"{selected_note}.json")
 
+        # Spaced repetition: only the questions due for review, then the ones never answered;
+        # hard questions: drawn among those answered below half marks on average
+        review_mode = st.radio("Questions", ["All", "Due for review", "Hard questions"], horizontal=True)
+
         # Question initialization
-        if "questions" not in st.session_state or st.session_state.get("current_note") != selected_note:
-            st.session_state.questions = load_question(selected_note) # API call to load questions specific to a certain course
+        if ("questions" not in st.session_state or st.session_state.get("current_note") != selected_note
+                or st.session_state.get("review_mode") != review_mode):
+            if review_mode == "Due for review":
+                st.session_state.questions = get_due_questions(selected_note)
+            elif review_mode == "Hard questions":
+                st.session_state.questions = sample_questions(selected_note, max_mean=2.5)
+            else:
+                st.session_state.questions = load_question(selected_note) # API call to load questions specific to a certain course
             st.session_state.current_note = selected_note
+            st.session_state.review_mode = review_mode
 
             # Initialize a dictionary to store answers
             st.session_state.user_answers = {}
 
         # Generate new questions
+        force_generation = st.checkbox("Regenerate even if questions were already generated for this content")
         if st.button("Generate questions"):
             try:
+                new_questions = []
+                preview = st.empty()
                 with st.spinner("Generation of current questions..."):
-                    new_questions = generate_questions(selected_note, note_content) # API call to generate questions 
+                    # API call streaming the questions as the model writes them
+                    for question in stream_questions(selected_note, note_content, force=force_generation):
+                        new_questions.append(question)
+                        preview.markdown("\n".join(f"{i}. {q['text']}" for i, q in enumerate(new_questions, 1)))
+                preview.empty()
                 
                 if new_questions:
                     # update_questions_file(new_questions, selected_note)
@@ -531,25 +564,32 @@ elif menu == "❓Quiz Mode":
             if st.button("📝 Check all answers"):
                 total_score = 0
                 with st.spinner("Evaluation of current responses..."):
-                    for i, question in enumerate(st.session_state.questions, 1):
-                        answer_key = f"answer_{i}"
-                        user_answer = st.session_state.user_answers.get(answer_key, "")
-
-                        # Evaluating the response
-                        evaluation = evaluate_answer(
-                            question['text'],
-                            user_answer,
-                            question['reponse']
-                        )
-
-                        # Save result
-                        save_quiz_result(
-                            selected_note,
-                            question['text'],
-                            user_answer,
-                            question['reponse'],
-                            evaluation['score']
-                        )
+                    answers = [
+                        {
+                            "question": question['text'],
+                            "user_answer": st.session_state.user_answers.get(f"answer_{i}", ""),
+                            "correct_answer": question['reponse'],
+                        }
+                        for i, question in enumerate(st.session_state.questions, 1)
+                    ]
+
+                    # Evaluating all the responses in one request
+                    try:
+                        evaluations = evaluate_answers(answers)
+                    except Exception as e:
+                        st.error(f"Answers could not be assessed, please try again later: {e}")
+                        st.stop()
+
+                    results = []
+                    for i, (question, evaluation) in enumerate(zip(st.session_state.questions, evaluations), 1):
+                        user_answer = answers[i - 1]["user_answer"]
+
+                        results.append({
+                            "question": question['text'],
+                            "user_answer": user_answer,
+                            "correct_answer": question['reponse'],
+                            "score": evaluation['score']
+                        })
 
                         total_score += evaluation['score']
 
@@ -559,6 +599,12 @@ elif menu == "❓Quiz Mode":
                             st.write(f"**Correct answer:** {question['reponse']}")
                             st.write(f"**Score:** {evaluation['score']}/5")
 
+                    # Save all the results in one request
+                    try:
+                        save_quiz_results(selected_note, results)
+                    except Exception as e:
+                        st.error(f"Results could not be saved: {e}")
+
                 # Display total score
                 avg_score = total_score / len(st.session_state.questions)
                 st.success(f"Total score : {avg_score:.1f}/5")
@@ -586,51 +632,77 @@ elif menu == "❓Quiz Mode":
 elif menu == "📈📉 Performances":
     st.header("📊 Learning performance")
 
-    stats = get_all_stats()
-    if not stats:
+    summary = get_stats_summary()
+    if not summary["notes"]:
         st.info("No statistics available yet. Start taking quizzes to see how you're doing!")
     else:
         # Global overview
         st.subheader("Vue d'ensemble")
 
-        # Calculate overall statistics
-        all_scores, notes_avg_scores = compute_overall_performance(stats)
-
         # Display overall average score
-        if all_scores:
-            global_avg = sum(all_scores) / len(all_scores)
-            st.metric("Overall average score", f"{global_avg:.1f}/5")
+        if summary["overall"]["count"]:
+            st.metric("Overall average score", f"{summary['overall']['average']:.1f}/5")
             
             # Graph of average scores by note
-            st.bar_chart(notes_avg_scores)
+            st.bar_chart({note_title: note_summary["average"] for note_title, note_summary in summary["notes"].items()})
+
+            # Daily activity and average score
+            analytics = get_stats_analytics()
+            if analytics["days"]:
+                st.line_chart({
+                    "Day": [day["day"] for day in analytics["days"]],
+                    "Average score": [day["mean"] for day in analytics["days"]]
+                }, x="Day", y="Average score")
+        else:
+            analytics = {"notes": {}}
 
         # Details by note
         st.subheader("Details by note")
-        for note_title, note_stats in stats.items():
+        for note_title, note_summary in summary["notes"].items():
             with st.expander(f"📝 {note_title}"):
-                if note_stats["attempts"]:
-                    col1, col2, col3 = st.columns(3)
+                if note_summary["count"]:
+                    col1, col2, col3, col4 = st.columns(4)
+                    note_analytics = analytics["notes"].get(note_title)
                     
                     # Basic statistics
-                    scores = [int(attempt["score"]) for attempt in note_stats["attempts"]]
-                    avg_score = sum(scores) / len(scores)
                     with col1:
-                        st.metric("Average score", f"{avg_score:.1f}/5")
+                        st.metric("Average score", f"{note_summary['average']:.1f}/5")
                     with col2:
-                        st.metric("Best score", f"{max(scores)}/5")
+                        st.metric("Best score", f"{note_summary['max']:g}/5")
                     with col3:
-                        st.metric("Number of questions", len(scores))
+                        st.metric("Number of questions", note_summary["count"])
+                    with col4:
+                        if note_analytics:
+                            st.metric("Median score", f"{note_analytics['median']:g}/5",
+                                      delta=f"{note_analytics['slope']:+.2f}/day")
+
+                    # Questions with the lowest average score, across every user
+                    hardest = get_question_difficulty(note_title, limit=5)
+                    if hardest:
+                        st.markdown("**Hardest questions**")
+                        st.table([{"Question": question["question"], "Attempts": question["count"],
+                                   "Average": f"{question['mean']:g}/5"} for question in hardest])
+
+                    # Attempts loaded so far, newest first; reloaded when new attempts were saved
+                    history_key = f"history_{note_title}"
+                    history = st.session_state.get(history_key)
+                    if history is None or history["count"] != note_summary["count"]:
+                        page = get_note_attempts(note_title)
+                        history = {"count": note_summary["count"], "attempts": page["attempts"], "next_cursor": page["next_cursor"]}
+                        st.session_state[history_key] = history
                     
                     # Score evolution graph
+                    scores = [float(attempt["score"]) for attempt in reversed(history["attempts"])]
+                    first_question = note_summary["count"] - len(scores) + 1
                     scores_df = {
-                        "Question": range(1, len(scores) + 1),
+                        "Question": range(first_question, first_question + len(scores)),
                         "Score": scores
                     }
                     st.line_chart(scores_df, x="Question", y="Score")
                     
                     # Detailed history
                     st.markdown("<h3 style='color: #0044CC;'>Detailed history</h3>", unsafe_allow_html=True)
-                    for attempt in reversed(note_stats["attempts"]):
+                    for attempt in history["attempts"]:
                         st.markdown(f"""
                             <div style="background-color: #333; padding: 10px; border-radius: 5px; margin-bottom: 10px;">
                                 <p style="font-size: 14px; color: #fff;">
@@ -642,6 +714,12 @@ elif menu == "📈📉 Performances":
                                 </p>
                             </div>
                             """, unsafe_allow_html=True)
+
+                    if history["next_cursor"] and st.button("⬇️ Load more", key=f"more_{note_title}"):
+                        page = get_note_attempts(note_title, cursor=history["next_cursor"])
+                        history["attempts"].extend(page["attempts"])
+                        history["next_cursor"] = page["next_cursor"]
+                        st.rerun()
                     
                     # Button to delete the history of this note
                     if st.button("🗑️ Delete history", key=f"delete_{note_title}"):
@@ -0,0 +1,75 @@
+"""
+Benchmarks the spaced-repetition due queue on a synthetic deck.
+
+    python -m scripts.benchmark_due_queue --cards 1000000 --notes 1000
+
+Fills a temporary stats views database, then times the "next N due" queries across all notes and
+for one note, and the update of an existing card after a review.
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import config
+
+
+def _timed(function, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations), max(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the spaced-repetition due queue")
+    parser.add_argument("--cards", type=int, default=1_000_000)
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--due", type=int, default=20, help="Number of due questions asked per query")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="notemaster-bench-")
+    config.STATS_VIEWS_PATH = os.path.join(directory, "stats_views.sqlite3")
+    # Imported after the path is overridden so that the benchmark never touches the real database
+    from utils import stats_views, spaced_repetition
+    from utils.text_utils import question_hash
+
+    # The synthetic deck replaces the reconciliation with the attempt history
+    stats_views._state["reconciled"] = True
+    now = time.time()
+    started = time.perf_counter()
+    with stats_views._get_db().transaction() as conn:
+        conn.executemany(
+            "INSERT INTO cards (card_id, note_title, question, correct_answer, ease, interval, repetitions, due, "
+            "last_review, last_score) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((question_hash(f"note {index % args.notes}", f"Question {index}"), f"note {index % args.notes}",
+              f"Question {index}", f"Answer {index}", 2.5, 6.0, 2,
+              now + random.uniform(-30, 30) * spaced_repetition.SECONDS_PER_DAY, now, 4.0)
+             for index in range(args.cards)),
+        )
+    print(f"Filled {args.cards} cards over {args.notes} notes in {time.perf_counter() - started:.1f} s")
+
+    median, worst = _timed(lambda: spaced_repetition.get_due_cards(args.due), args.repeat)
+    print(f"Next {args.due} due cards, all notes: median {median:.2f} ms, max {worst:.2f} ms")
+    median, worst = _timed(lambda: spaced_repetition.get_due_cards(args.due, note_title=f"note {random.randrange(args.notes)}"), args.repeat)
+    print(f"Next {args.due} due cards, one note: median {median:.2f} ms, max {worst:.2f} ms")
+
+    def review():
+        # An existing card, so that the update is timed rather than the insert of a new one
+        index = random.randrange(args.cards)
+        with stats_views._get_db().transaction() as conn:
+            spaced_repetition.apply_attempts(conn, f"note {index % args.notes}", [
+                {"timestamp": None, "question": f"Question {index}", "correct_answer": f"Answer {index}", "score": random.randint(0, 5)}
+            ])
+
+    median, worst = _timed(review, args.repeat)
+    print(f"Review update: median {median:.2f} ms, max {worst:.2f} ms")
+    print(f"Database left in {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Calibrates the uncertainty band of the local pre-scorer against the grades already
+given by the LLM and stored in the stats history.
+
+    python -m scripts.calibrate_prescorer --precision 0.95
+"""
+import argparse
+import numpy as np
+from config import PRESCORER_WEIGHTS, PRESCORER_LOW, PRESCORER_HIGH
+from utils.prescorer import features
+from utils.stats_manager import get_all_stats
+
+
+def load_samples():
+    """
+    :return: (features matrix, LLM scores) of every graded attempt with a non-blank answer
+    """
+    rows, scores = [], []
+    for note_stats in get_all_stats().values():
+        for attempt in note_stats["attempts"]:
+            if not str(attempt.get("user_answer") or "").strip():
+                continue
+            rows.append(features(attempt["user_answer"], attempt["correct_answer"]))
+            scores.append(float(attempt["score"]))
+    return np.array(rows, dtype=np.float32).reshape(-1, 3), np.array(scores, dtype=np.float32)
+
+
+def calibrate(similarities, scores, precision, low_grade_max=1, high_grade_min=4):
+    """
+    Finds the widest band ends such that at least `precision` of the attempts below the low end
+    were graded <= low_grade_max and of those above the high end were graded >= high_grade_min
+    :return: (low, high, fraction of attempts below low, fraction of attempts above high)
+    """
+    order = np.argsort(similarities)
+    sorted_similarities = similarities[order]
+    sorted_scores = scores[order]
+    count = len(sorted_scores)
+
+    # Precision of "everything up to index i is a low grade"
+    low_hits = np.cumsum(sorted_scores <= low_grade_max)
+    low_precision = low_hits / np.arange(1, count + 1)
+    low_ok = np.nonzero(low_precision >= precision)[0]
+    low_index = low_ok.max() if low_ok.size else -1
+    low = float(sorted_similarities[low_index]) if low_index >= 0 else 0.0
+
+    # Precision of "everything from index i on is a high grade"
+    high_hits = np.cumsum((sorted_scores >= high_grade_min)[::-1])[::-1]
+    high_precision = high_hits / np.arange(count, 0, -1)
+    high_ok = np.nonzero(high_precision >= precision)[0]
+    high_index = high_ok.min() if high_ok.size else count
+    high = float(sorted_similarities[high_index]) if high_index < count else 1.0
+
+    return low, high, (low_index + 1) / count, (count - high_index) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate PRESCORER_LOW / PRESCORER_HIGH from past grades")
+    parser.add_argument("--precision", type=float, default=0.95,
+                        help="Required agreement with the LLM grades inside each short-circuit region")
+    args = parser.parse_args()
+
+    matrix, scores = load_samples()
+    if not len(scores):
+        print("No graded attempts found in the stats history.")
+        return
+
+    weights = np.asarray(PRESCORER_WEIGHTS, dtype=np.float32)
+    similarities = matrix @ weights / weights.sum()
+    low, high, low_share, high_share = calibrate(similarities, scores, args.precision)
+
+    print(f"Attempts analysed: {len(scores)}")
+    print(f"Current band: PRESCORER_LOW={PRESCORER_LOW} PRESCORER_HIGH={PRESCORER_HIGH}")
+    print(f"Suggested band: PRESCORER_LOW={low:.3f} PRESCORER_HIGH={high:.3f}")
+    print(f"Short-circuited with the suggested band: {low_share:.1%} graded 0, {high_share:.1%} graded 5")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Exports the quiz attempts to a columnar file for offline analysis.
+
+    python -m scripts.export_attempts --output attempts.npz
+    python -m scripts.export_attempts --output attempts-new.npz --watermark-file db/export.watermark
+
+With --watermark-file, only the attempts saved since the previous export are written and the
+file is updated with the new watermark.
+"""
+import os
+import argparse
+from utils.stats_export import export_attempts, NPZ, PARQUET
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the quiz attempts to .npz or Parquet")
+    parser.add_argument("--output", required=True, help="File to write")
+    parser.add_argument("--format", choices=(NPZ, PARQUET), default=None,
+                        help="Defaults to the extension of the output file, then npz")
+    parser.add_argument("--since", default=None, help="Watermark of a previous export")
+    parser.add_argument("--watermark-file", default=None,
+                        help="File holding the watermark of the previous export, updated after this one")
+    args = parser.parse_args()
+
+    since = args.since
+    if since is None and args.watermark_file and os.path.exists(args.watermark_file):
+        with open(args.watermark_file, "r", encoding="utf-8") as file:
+            since = file.read().strip() or None
+    file_format = args.format or (PARQUET if args.output.endswith(".parquet") else NPZ)
+
+    result = export_attempts(args.output, since=since, file_format=file_format)
+    if args.watermark_file and result["watermark"]:
+        with open(args.watermark_file, "w", encoding="utf-8") as file:
+            file.write(result["watermark"])
+    print(f"Exported {result['attempts']} attempts to {args.output} ({result['bytes']} bytes)")
+    print(f"Watermark: {result['watermark']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+OpenAI-compatible stub of the chat completions API, answering NoteMaster's prompts with
+deterministic questions and grades so the app can be benchmarked and load-tested offline.
+
+    python -m scripts.llm_stub_server --port 8001 --latency 0.5 --jitter 0.2
+    LLM_BASE_URL=http://127.0.0.1:8001/v1 uvicorn main:app
+
+Answers can also be recorded from it (LLM_MODE=record) and replayed without any server.
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import hashlib
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from utils.prescorer import similarity
+
+app = FastAPI()
+settings = {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "rate_limit_rate": 0.0, "chunk_size": 16}
+
+
+def _questions(note_content):
+    """
+    One question per sentence of the note, up to 10
+    """
+    sentences = [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", note_content) if len(sentence.strip()) > 3]
+    return [
+        {"text": f"What does the note say about \"{' '.join(sentence.split()[:6])}\"?", "reponse": sentence}
+        for sentence in sentences[:10]
+    ] or [{"text": "What is this note about?", "reponse": note_content.strip()}]
+
+
+def _grade(user_answer, correct_answer):
+    return round(5 * similarity(user_answer, correct_answer))
+
+
+def _field(prompt, name, next_name):
+    match = re.search(rf"{name}: (.*?)\n{next_name}:", prompt, re.S)
+    return match.group(1) if match else ""
+
+
+def answer(prompt):
+    """
+    :return: Completion text for one of the NoteMaster prompts
+    """
+    if "Grade each of the following" in prompt:
+        items = prompt.split("### Answer ")[1:]
+        scores = [
+            _grade(item.split("Student response: ", 1)[-1].split("\n\nValuation rules:")[0],
+                   _field(item, "Correct answer", "Student response"))
+            for item in items
+        ]
+        return json.dumps({"scores": scores})
+    if "Student response:" in prompt:
+        user_answer = prompt.split("Student response: ", 1)[1].split("\n\nValuation rules:")[0]
+        return json.dumps({"score": _grade(user_answer, _field(prompt, "Correct answer", "Student response"))})
+    note_content = prompt.split("Text : ", 1)[-1].rsplit("\nReturns JSON only", 1)[0]
+    return "```json\n" + json.dumps(_questions(note_content), ensure_ascii=False) + "\n```"
+
+
+def _completion_id(prompt):
+    return "chatcmpl-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:24]
+
+
+def _latency():
+    return settings["latency"] * (1 + random.uniform(-settings["jitter"], settings["jitter"]))
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < settings["rate_limit_rate"]:
+        return JSONResponse({"error": {"message": "Rate limit exceeded"}}, status_code=429, headers={"Retry-After": "1"})
+    if random.random() < settings["error_rate"]:
+        return JSONResponse({"error": {"message": "Upstream error"}}, status_code=500)
+
+    prompt = body["messages"][-1]["content"]
+    content = answer(prompt)
+    completion_id = _completion_id(prompt)
+    created = int(time.time())
+
+    if body.get("stream"):
+        parts = [content[i:i + settings["chunk_size"]] for i in range(0, len(content), settings["chunk_size"])]
+        delay = _latency() / max(len(parts), 1)
+
+        async def events():
+            for index, part in enumerate(parts):
+                await asyncio.sleep(delay)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": part} if index == 0 else {"content": part},
+                                 "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": body["model"],
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(_latency())
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                  "total_tokens": (len(prompt) + len(content)) // 4},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server for offline benchmarking")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Relative latency variation (0.2 = +/- 20%%)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with a 429")
+    args = parser.parse_args()
+    settings.update(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                    rate_limit_rate=args.rate_limit_rate)
+    # Imported here so that the app can be mounted in-process without uvicorn installed
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import threading
+from config import STORAGE_BACKEND, SQLITE_DB_PATH, NOTES_DIR, QUESTIONS_DIR, STATS_DIR
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def create_storage(backend, **options):
+    """
+    Builds a storage backend
+    :param backend: "filesystem" or "sqlite"
+    :param options: Overrides of the configured directories or database path
+    :return: StorageBackend instance
+    """
+    if backend == "filesystem":
+        from storage.filesystem import FilesystemStorage
+        return FilesystemStorage(
+            options.get("notes_dir", NOTES_DIR),
+            options.get("questions_dir", QUESTIONS_DIR),
+            options.get("stats_dir", STATS_DIR),
+        )
+    if backend == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(options.get("path", SQLITE_DB_PATH))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def get_storage():
+    """
+    Returns the process-wide storage backend selected by STORAGE_BACKEND
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage(STORAGE_BACKEND)
+    return _storage
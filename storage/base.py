@@ -0,0 +1,184 @@
+# Attempts read at a time while looking for those within the time bounds of a page
+_SCAN_CHUNK = 256
+
+
+class AttemptList(list):
+    """
+    Attempts held in memory in storage order, as expected by paginate
+    """
+
+    def slice(self, start, stop):
+        return self[start:stop]
+
+
+def _in_bounds(attempt, since, until):
+    timestamp = attempt.get("timestamp", "")
+    return (not since or timestamp >= since) and (not until or timestamp < until)
+
+
+def paginate(attempts, limit, cursor=None, since=None, until=None):
+    """
+    Newest-first page of a sequence of attempts in storage order. The cursor is the position of the
+    oldest attempt returned, which stays valid as new attempts are appended.
+    Storage order is not timestamp order (an attempt replayed after a crash keeps its original time),
+    so with since/until the attempts are filtered while walking back from the cursor, a chunk at a time.
+    :param attempts: Sequence with len() and slice(start, stop)
+    :return: Dictionary with the attempts and the cursor of the next page
+    """
+    high = len(attempts) if cursor is None else max(0, min(len(attempts), int(cursor)))
+    if not since and not until:
+        start = max(0, high - limit)
+        page = attempts.slice(start, high)[::-1] if start < high else []
+        return {"attempts": page, "next_cursor": str(start) if start > 0 else None}
+    # One match past the page tells whether there is a next one
+    matches = []
+    while high > 0 and len(matches) <= limit:
+        start = max(0, high - max(limit + 1, _SCAN_CHUNK))
+        chunk = attempts.slice(start, high)
+        for position in range(high - 1, start - 1, -1):
+            if _in_bounds(chunk[position - start], since, until):
+                matches.append((position, chunk[position - start]))
+                if len(matches) > limit:
+                    break
+        high = start
+    page = matches[:limit]
+    return {"attempts": [attempt for _, attempt in page],
+            "next_cursor": str(page[-1][0]) if len(matches) > limit else None}
+
+
+class StorageBackend:
+    """
+    Interface shared by the storage engines used for notes, questions and stats.
+    Each entity is keyed by its note title.
+    """
+
+    name = None
+
+    # ---------- Notes ----------
+
+    def stat_notes(self):
+        """
+        :return: Dictionary title -> (mtime_ns, size) for every note
+        """
+        raise NotImplementedError
+
+    def stat_note(self, title):
+        """
+        :return: (mtime_ns, size) of the note, or None if it does not exist
+        """
+        raise NotImplementedError
+
+    def read_note(self, title):
+        """
+        :return: Note content, or None if it does not exist
+        """
+        raise NotImplementedError
+
+    def write_note(self, title, content):
+        """
+        Creates or replaces a note
+        :return: (mtime_ns, size) of the written note
+        """
+        raise NotImplementedError
+
+    def delete_note(self, title):
+        raise NotImplementedError
+
+    # ---------- Questions ----------
+
+    def questions_exist(self, title):
+        raise NotImplementedError
+
+    def read_questions(self, title):
+        """
+        :return: List of questions of the note, empty if none were generated
+        """
+        raise NotImplementedError
+
+    def write_questions(self, title, questions):
+        raise NotImplementedError
+
+    def delete_questions(self, title):
+        raise NotImplementedError
+
+    # ---------- Stats ----------
+
+    def list_stats_notes(self):
+        """
+        :return: Titles of the notes having a stats history
+        """
+        raise NotImplementedError
+
+    def read_attempts(self, note_title):
+        """
+        :return: Attempts of the note in chronological order
+        """
+        raise NotImplementedError
+
+    def read_attempts_page(self, note_title, limit, cursor=None, since=None, until=None):
+        """
+        Lists the attempts of a note most recently saved first, one page at a time
+        :param limit: Maximum number of attempts to return
+        :param cursor: Cursor returned with the previous page, None for the newest attempts
+        :param since: Only attempts at or after this ISO timestamp
+        :param until: Only attempts before this ISO timestamp
+        :return: Dictionary with the attempts and the cursor of the next page
+        """
+        return paginate(AttemptList(self.read_attempts(note_title)), limit, cursor, since, until)
+
+    def read_attempts_after(self, note_title, seq=None, upto=None):
+        """
+        Lists the attempts of a note in storage order, the order in which they became visible. Each
+        attempt has a sequence number "seq" that grows in that order across all notes, so a reader
+        that remembers the last number it saw gets every attempt saved since, however late it was
+        timestamped. Attempts saved before the numbers existed have none and count as 0.
+        :param seq: Only attempts numbered above this, None for all of them
+        :param upto: Only attempts numbered up to this, None for no bound
+        :return: List of attempts
+        """
+        return [attempt for attempt in self.read_attempts(note_title)
+                if (seq is None or attempt.get("seq", 0) > seq) and (upto is None or attempt.get("seq", 0) <= upto)]
+
+    def last_attempt_seq(self):
+        """
+        :return: Highest sequence number given to an attempt; every attempt numbered up to it is visible
+        """
+        raise NotImplementedError
+
+    def append_attempt(self, note_title, attempt):
+        raise NotImplementedError
+
+    def append_attempts(self, note_title, attempts):
+        """
+        Appends several attempts of a note, in one write when the backend allows it
+        """
+        for attempt in attempts:
+            self.append_attempt(note_title, attempt)
+
+    def unsaved_attempts(self, note_title, attempts):
+        """
+        Filters out the attempts already saved, recognized by their "id", to write a batch again
+        after an interrupted write without duplicating it. Reads the whole history by default.
+        :return: The attempts of the list that are not in the note's history, in the same order
+        """
+        saved = {attempt.get("id") for attempt in self.read_attempts(note_title)}
+        return [attempt for attempt in attempts if attempt.get("id") is None or attempt["id"] not in saved]
+
+    def compact_attempts(self):
+        """
+        Folds the attempts appended since the last call into their compact form, if the backend has one
+        :return: Number of attempts compacted
+        """
+        return 0
+
+    def delete_stats(self, note_title):
+        """
+        :return: True if a history was deleted, False otherwise
+        """
+        raise NotImplementedError
+
+    def delete_all_stats(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
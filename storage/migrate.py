@@ -0,0 +1,66 @@
+"""
+Copies notes, questions and stats from one storage backend to another.
+
+Import the existing notes/, questions/ and stats/ directories into SQLite:
+    python -m storage.migrate --source filesystem --target sqlite
+"""
+import argparse
+import logging
+from storage import create_storage
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def migrate(source, target):
+    """
+    Copies every note, question set and attempt history from source to target
+    Existing question sets and histories of the same notes are replaced in the target.
+    :param source: StorageBackend to read from
+    :param target: StorageBackend to write to
+    :return: Dictionary with the number of migrated notes, question sets and attempts
+    """
+    counts = {"notes": 0, "question_sets": 0, "attempts": 0}
+
+    for title in source.stat_notes():
+        content = source.read_note(title)
+        if content is None:
+            continue
+        target.write_note(title, content)
+        counts["notes"] += 1
+        if source.questions_exist(title):
+            target.write_questions(title, source.read_questions(title))
+            counts["question_sets"] += 1
+
+    for note_title in source.list_stats_notes():
+        attempts = source.read_attempts(note_title)
+        target.delete_stats(note_title)
+        # One write (one transaction on SQLite) per note
+        target.append_attempts(note_title, attempts)
+        counts["attempts"] += len(attempts)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate NoteMaster data between storage backends")
+    parser.add_argument("--source", default="filesystem", choices=["filesystem", "sqlite"])
+    parser.add_argument("--target", default="sqlite", choices=["filesystem", "sqlite"])
+    parser.add_argument("--sqlite-path", help="SQLite database path (defaults to SQLITE_DB_PATH)")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("Source and target backends must differ")
+
+    options = {"path": args.sqlite_path} if args.sqlite_path else {}
+    source = create_storage(args.source, **options)
+    target = create_storage(args.target, **options)
+    try:
+        counts = migrate(source, target)
+    finally:
+        source.close()
+        target.close()
+    logging.info("Migrated %(notes)d notes, %(question_sets)d question sets and %(attempts)d attempts", counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from storage.base import StorageBackend
+
+
+def connect_sqlite(path):
+    """
+    Opens a SQLite connection in WAL mode, suited to concurrent readers and one writer at a time
+    :param path: Database file path
+    :return: sqlite3 connection in autocommit mode
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class ThreadLocalConnections:
+    """
+    Hands out one SQLite connection per thread for a given database file
+    """
+
+    def __init__(self, path, schema=None):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        if schema:
+            conn = self.get()
+            conn.executescript(schema)
+
+    def get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the block inside BEGIN IMMEDIATE so concurrent writers serialize instead of failing
+        """
+        conn = self.get()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    title TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS question_sets (
+    note_title TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS questions (
+    note_title TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (note_title, position)
+);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    note_title TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    question TEXT,
+    user_answer TEXT,
+    correct_answer TEXT,
+    score,
+    attempt_id TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_attempts_note_id ON attempts(note_title, id);
+CREATE INDEX IF NOT EXISTS idx_attempts_note_timestamp ON attempts(note_title, timestamp);
+"""
+
+ATTEMPT_FIELDS = ("timestamp", "question", "user_answer", "correct_answer", "score", "id")
+ATTEMPT_COLUMNS = "timestamp, question, user_answer, correct_answer, score, attempt_id"
+
+
+def _to_attempt(row):
+    """
+    :param row: ATTEMPT_COLUMNS followed by the row id, which is the attempt's sequence number
+    """
+    return dict(zip(ATTEMPT_FIELDS + ("seq",), row))
+
+
+class SQLiteStorage(StorageBackend):
+    """
+    Single SQLite database in WAL mode holding notes, questions and attempts
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.db = ThreadLocalConnections(path, SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        conn = self.db.get()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(attempts)")]
+        if "attempt_id" not in columns:
+            conn.execute("ALTER TABLE attempts ADD COLUMN attempt_id TEXT")
+        # Attempts saved before they had an id are NULL, which the unique index allows several times
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_attempts_attempt_id ON attempts(attempt_id)")
+
+    # ---------- Notes ----------
+
+    def stat_notes(self):
+        rows = self.db.get().execute("SELECT title, mtime_ns, size FROM notes")
+        return {title: (mtime_ns, size) for title, mtime_ns, size in rows}
+
+    def stat_note(self, title):
+        row = self.db.get().execute("SELECT mtime_ns, size FROM notes WHERE title = ?", (title,)).fetchone()
+        return tuple(row) if row else None
+
+    def read_note(self, title):
+        row = self.db.get().execute("SELECT content FROM notes WHERE title = ?", (title,)).fetchone()
+        return row[0] if row else None
+
+    def write_note(self, title, content):
+        version = (time.time_ns(), len(content.encode("utf-8")))
+        self.db.get().execute(
+            "INSERT INTO notes (title, content, size, mtime_ns) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(title) DO UPDATE SET content = excluded.content, size = excluded.size, mtime_ns = excluded.mtime_ns",
+            (title, content, version[1], version[0]),
+        )
+        return version
+
+    def delete_note(self, title):
+        self.db.get().execute("DELETE FROM notes WHERE title = ?", (title,))
+
+    # ---------- Questions ----------
+
+    def questions_exist(self, title):
+        row = self.db.get().execute("SELECT 1 FROM question_sets WHERE note_title = ?", (title,)).fetchone()
+        return row is not None
+
+    def read_questions(self, title):
+        rows = self.db.get().execute(
+            "SELECT data FROM questions WHERE note_title = ? ORDER BY position", (title,)
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def write_questions(self, title, questions):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM questions WHERE note_title = ?", (title,))
+            conn.execute(
+                "INSERT INTO question_sets (note_title, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(note_title) DO UPDATE SET updated_at = excluded.updated_at",
+                (title, time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO questions (note_title, position, data) VALUES (?, ?, ?)",
+                [(title, position, json.dumps(question, ensure_ascii=False))
+                 for position, question in enumerate(questions)],
+            )
+
+    def delete_questions(self, title):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM questions WHERE note_title = ?", (title,))
+            conn.execute("DELETE FROM question_sets WHERE note_title = ?", (title,))
+
+    # ---------- Stats ----------
+
+    def list_stats_notes(self):
+        rows = self.db.get().execute("SELECT DISTINCT note_title FROM attempts")
+        return [note_title for (note_title,) in rows]
+
+    def read_attempts(self, note_title):
+        rows = self.db.get().execute(
+            f"SELECT {ATTEMPT_COLUMNS}, id FROM attempts WHERE note_title = ? ORDER BY id",
+            (note_title,),
+        )
+        return [_to_attempt(row) for row in rows]
+
+    def read_attempts_page(self, note_title, limit, cursor=None, since=None, until=None):
+        # The cursor is the id of the oldest attempt returned, found through idx_attempts_note_id
+        query = f"SELECT {ATTEMPT_COLUMNS}, id FROM attempts WHERE note_title = ?"
+        params = [note_title]
+        if cursor is not None:
+            query += " AND id < ?"
+            params.append(int(cursor))
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until:
+            query += " AND timestamp < ?"
+            params.append(until)
+        rows = self.db.get().execute(query + " ORDER BY id DESC LIMIT ?", params + [limit + 1]).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "attempts": [_to_attempt(row) for row in rows],
+            "next_cursor": str(rows[-1][-1]) if has_more else None,
+        }
+
+    def read_attempts_after(self, note_title, seq=None, upto=None):
+        # The sequence number is the AUTOINCREMENT id: ids are never reused, even after a delete
+        query = f"SELECT {ATTEMPT_COLUMNS}, id FROM attempts WHERE note_title = ?"
+        params = [note_title]
+        if seq is not None:
+            query += " AND id > ?"
+            params.append(seq)
+        if upto is not None:
+            query += " AND id <= ?"
+            params.append(upto)
+        return [_to_attempt(row) for row in self.db.get().execute(query + " ORDER BY id", params)]
+
+    def last_attempt_seq(self):
+        row = self.db.get().execute("SELECT seq FROM sqlite_sequence WHERE name = 'attempts'").fetchone()
+        return row[0] if row else 0
+
+    def append_attempt(self, note_title, attempt):
+        self.append_attempts(note_title, [attempt])
+
+    def append_attempts(self, note_title, attempts):
+        # An attempt whose id is already saved is skipped, so a batch written again is not duplicated
+        with self.db.transaction() as conn:
+            conn.executemany(
+                f"INSERT INTO attempts (note_title, {ATTEMPT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (attempt_id) DO NOTHING",
+                [(note_title, *(attempt.get(field) for field in ATTEMPT_FIELDS)) for attempt in attempts],
+            )
+
+    def unsaved_attempts(self, note_title, attempts):
+        return attempts
+
+    def delete_stats(self, note_title):
+        cursor = self.db.get().execute("DELETE FROM attempts WHERE note_title = ?", (note_title,))
+        return cursor.rowcount > 0
+
+    def delete_all_stats(self):
+        self.db.get().execute("DELETE FROM attempts")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,185 @@
+import time
+import threading
+import numpy as np
+from storage import get_storage
+from utils import stats_aggregates
+from utils.stats_aggregates import parse_score
+
+PERCENTILES = (10, 25, 50, 75, 90)
+_MICROSECONDS_PER_DAY = 86400 * 10 ** 6
+# Scores up to this value are counted in a histogram rather than sorted for the percentiles
+MAX_HISTOGRAM_SCORE = 100
+
+_lock = threading.Lock()
+# note title -> {"version", "seq" (last sequence number loaded), "timestamps" (int64 microseconds),
+#                "scores" (float64), "statistics"}
+_columns = {}
+
+
+def _to_columns(attempts):
+    """
+    :return: (timestamps in microseconds since the epoch, scores) of the attempts with a numeric score
+    """
+    pairs = [(attempt.get("timestamp"), parse_score(attempt.get("score"))) for attempt in attempts]
+    pairs = [(timestamp, score) for timestamp, score in pairs if timestamp and score is not None]
+    timestamps = np.array([timestamp for timestamp, _ in pairs], dtype="datetime64[us]").astype(np.int64)
+    scores = np.array([score for _, score in pairs], dtype=np.float64)
+    return timestamps, scores
+
+
+def _last_seq(attempts, default=None):
+    return max((attempt.get("seq", 0) for attempt in attempts), default=default)
+
+
+def _refresh():
+    """
+    Brings the columns in line with the stats summary: notes whose count grew only load the attempts
+    saved since their last load, found by storage sequence number so that attempts saved late with
+    an older timestamp are not missed; notes whose history shrank, or whose catch-up does not match
+    the summary count, are loaded again and deleted notes are dropped
+    """
+    storage = get_storage()
+    summary = stats_aggregates.get_summary()["notes"]
+    for note_title in set(_columns) - set(summary):
+        del _columns[note_title]
+    for note_title, note_summary in summary.items():
+        version = (note_summary["count"], note_summary["last_attempt"])
+        cached = _columns.get(note_title)
+        if cached is not None and cached["version"] == version:
+            continue
+        timestamps = None
+        if cached is not None and cached["version"][0] < version[0] and cached["seq"] is not None:
+            attempts = storage.read_attempts_after(note_title, cached["seq"])
+            seq = _last_seq(attempts, cached["seq"])
+            timestamps, scores = _to_columns(attempts)
+            timestamps = np.concatenate([cached["timestamps"], timestamps])
+            scores = np.concatenate([cached["scores"], scores])
+            if len(scores) != version[0]:
+                # The catch-up does not add up to the summary, e.g. the note was deleted and saved again
+                timestamps = None
+        if timestamps is None:
+            attempts = storage.read_attempts(note_title)
+            seq = _last_seq(attempts)
+            timestamps, scores = _to_columns(attempts)
+        _columns[note_title] = {
+            "version": version,
+            "seq": seq,
+            "timestamps": timestamps,
+            "scores": scores,
+            "statistics": _note_statistics(timestamps, scores) if len(scores) else None,
+        }
+
+
+def _moving_average(scores, window, points):
+    """
+    :return: The last points means of window consecutive scores (of all of them when there are fewer)
+    """
+    scores = scores[-(points + window - 1):]
+    window = min(window, len(scores))
+    sums = np.cumsum(np.concatenate([[0.0], scores]))
+    return (sums[window:] - sums[:-window]) / window
+
+
+def _note_statistics(timestamps, scores):
+    """
+    Sufficient statistics of a note's scores, computed once per change of the note. The analytics of
+    any set of notes are derived from them without going back to the attempts.
+    """
+    days = timestamps / _MICROSECONDS_PER_DAY
+    day_numbers = timestamps // _MICROSECONDS_PER_DAY
+    first_day = int(day_numbers.min())
+    # Grades are small integers: a histogram gives exact percentiles and merges across notes
+    integral = bool(np.all(scores == np.round(scores))) and scores.min() >= 0 and scores.max() <= MAX_HISTOGRAM_SCORE
+    return {
+        "count": len(scores),
+        "sum": float(scores.sum()),
+        "sum_squares": float(scores @ scores),
+        "days_sum": float(days.sum()),
+        "days_squares": float(days @ days),
+        "days_scores": float(days @ scores),
+        "histogram": np.bincount(scores.astype(np.int64)) if integral else None,
+        "first_day": first_day,
+        "day_counts": np.bincount(day_numbers - first_day),
+        "day_sums": np.bincount(day_numbers - first_day, weights=scores),
+    }
+
+
+def _percentiles(statistics, titles):
+    histograms = [statistic["histogram"] for statistic in statistics]
+    if any(histogram is None for histogram in histograms):
+        return np.percentile(np.concatenate([_columns[title]["scores"] for title in titles]), PERCENTILES)
+    histogram = np.zeros(max(len(histogram) for histogram in histograms), dtype=np.int64)
+    for counts in histograms:
+        histogram[:len(counts)] += counts
+    # Same linear interpolation as np.percentile, the k-th smallest score being read from the cumulated counts
+    cumulative = np.cumsum(histogram)
+    positions = np.array(PERCENTILES) / 100 * (cumulative[-1] - 1)
+    lower = np.floor(positions)
+    low_values = np.searchsorted(cumulative, lower, side="right")
+    high_values = np.searchsorted(cumulative, np.minimum(lower + 1, cumulative[-1] - 1), side="right")
+    return low_values + (positions - lower) * (high_values - low_values)
+
+
+def _summarize(titles):
+    """
+    Count, mean, median, std, percentiles and slope (score change per day, positive when the results
+    improve) of the scores of several notes, combined from their statistics
+    """
+    statistics = [_columns[title]["statistics"] for title in titles]
+    count = sum(statistic["count"] for statistic in statistics)
+    mean = sum(statistic["sum"] for statistic in statistics) / count
+    variance = sum(statistic["sum_squares"] for statistic in statistics) / count - mean ** 2
+    days_sum = sum(statistic["days_sum"] for statistic in statistics)
+    days_spread = sum(statistic["days_squares"] for statistic in statistics) - days_sum ** 2 / count
+    covariance = sum(statistic["days_scores"] for statistic in statistics) - days_sum * mean
+    percentiles = _percentiles(statistics, titles)
+    return {
+        "count": count,
+        "mean": mean,
+        "median": float(percentiles[PERCENTILES.index(50)]),
+        "std": max(variance, 0.0) ** 0.5,
+        "percentiles": {f"p{p}": float(value) for p, value in zip(PERCENTILES, percentiles)},
+        "slope": round(covariance / days_spread, 5) if count > 1 and days_spread > 1e-9 else 0.0,
+    }
+
+
+def _daily_rollup(titles):
+    """
+    Number and mean of the scores of each day with attempts
+    """
+    statistics = [_columns[title]["statistics"] for title in titles]
+    first_day = min(statistic["first_day"] for statistic in statistics)
+    length = max(statistic["first_day"] + len(statistic["day_counts"]) for statistic in statistics) - first_day
+    counts, sums = np.zeros(length, dtype=np.int64), np.zeros(length)
+    for statistic in statistics:
+        offset = statistic["first_day"] - first_day
+        counts[offset:offset + len(statistic["day_counts"])] += statistic["day_counts"]
+        sums[offset:offset + len(statistic["day_sums"])] += statistic["day_sums"]
+    active = np.flatnonzero(counts)
+    dates = np.datetime_as_string((active + first_day).astype("datetime64[D]"))
+    return [{"day": str(day), "count": int(counts[offset]), "mean": round(float(sums[offset] / counts[offset]), 3)}
+            for day, offset in zip(dates, active)]
+
+
+def get_analytics(note_title=None, window=10, points=50):
+    """
+    Computes score analytics over the quiz history, from typed arrays cached between calls
+    :param note_title: Only analyse this note, None for every note
+    :param window: Number of attempts averaged by the moving average
+    :param points: Number of moving average values returned per note (the most recent ones)
+    :return: Dictionary with the per-note analytics (count, mean, median, std, percentiles, slope in
+             points per day, moving average), the overall ones, the per-day rollup and the computation time
+    """
+    started = time.perf_counter()
+    with _lock:
+        _refresh()
+        titles = [title for title in ([note_title] if note_title is not None else sorted(_columns))
+                  if title in _columns and _columns[title]["statistics"] is not None]
+        notes = {}
+        for title in titles:
+            notes[title] = _summarize([title])
+            # A note's attempts are in the order they were saved
+            notes[title]["moving_average"] = _moving_average(_columns[title]["scores"], window, points).round(3).tolist()
+        result = {"notes": notes, "overall": _summarize(titles) if titles else None,
+                  "days": _daily_rollup(titles) if titles else []}
+    return {**result, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
@@ -0,0 +1,116 @@
+import re
+
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+\S")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """
+    Rough token count of a text, about 4 characters per token for the models we use
+    """
+    return (len(text) + 3) // 4
+
+
+def _blocks(text):
+    """
+    Yields ("heading", line) and ("paragraph", text) blocks; blank lines separate paragraphs
+    """
+    paragraph = []
+    for line in text.splitlines():
+        if _HEADING_RE.match(line):
+            if paragraph:
+                yield "paragraph", "\n".join(paragraph)
+                paragraph = []
+            yield "heading", line.strip()
+        elif not line.strip():
+            if paragraph:
+                yield "paragraph", "\n".join(paragraph)
+                paragraph = []
+        else:
+            paragraph.append(line)
+    if paragraph:
+        yield "paragraph", "\n".join(paragraph)
+
+
+def _fit(paragraph, max_tokens):
+    """
+    Splits a paragraph larger than max_tokens on sentences, then on words
+    """
+    if estimate_tokens(paragraph) <= max_tokens:
+        return [paragraph]
+    pieces, current = [], ""
+    for sentence in _SENTENCE_RE.split(paragraph):
+        while estimate_tokens(sentence) > max_tokens:
+            words = sentence.split(" ")
+            head, size = [], 0
+            while words and (not head or size + len(words[0]) + 1 <= max_tokens * 4):
+                size += len(words[0]) + 1
+                head.append(words.pop(0))
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(" ".join(head))
+            sentence = " ".join(words)
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and estimate_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            candidate = sentence
+        current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sections(text, max_tokens):
+    """
+    Splits a note into sections of at most about max_tokens tokens. Every heading starts a new
+    section and is repeated at the top of each section cut from its body; paragraphs are packed
+    together up to the budget and oversized ones are cut on sentence boundaries.
+    :param text: Note content (Markdown or plain text)
+    :param max_tokens: Token budget of a section
+    :return: List of section texts, in note order
+    """
+    sections = []
+    heading, body, body_tokens = "", [], 0
+
+    def close():
+        if body:
+            sections.append("\n\n".join(([heading] if heading else []) + body))
+
+    for kind, block in _blocks(text):
+        if kind == "heading":
+            if body:
+                close()
+                heading, body, body_tokens = block, [], 0
+            else:
+                # Consecutive headings (e.g. a chapter and its first section) stay together
+                heading = f"{heading}\n{block}" if heading else block
+            continue
+        budget = max(max_tokens - estimate_tokens(heading), 1)
+        for piece in _fit(block, budget):
+            piece_tokens = estimate_tokens(piece)
+            if body and body_tokens + piece_tokens > budget:
+                close()
+                body, body_tokens = [], 0
+            body.append(piece)
+            body_tokens += piece_tokens
+    close()
+    return sections
+
+
+def split_paragraphs(text):
+    """
+    Splits a note into its paragraphs, each with the heading(s) it falls under
+    :param text: Note content (Markdown or plain text)
+    :return: List of (heading, paragraph) pairs in note order, heading is "" before the first one
+    """
+    paragraphs = []
+    heading, heading_has_body = "", False
+    for kind, block in _blocks(text):
+        if kind == "heading":
+            heading = f"{heading}\n{block}" if heading and not heading_has_body else block
+            heading_has_body = False
+        else:
+            paragraphs.append((heading, block))
+            heading_has_body = True
+    return paragraphs
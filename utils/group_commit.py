@@ -0,0 +1,364 @@
+import os
+import re
+import json
+import time
+import errno
+import socket
+import logging
+import threading
+import contextlib
+import concurrent.futures
+from collections import defaultdict
+from utils.job_queue import _pid_alive
+
+# {host}-{pid}.wal, renamed {host}-{pid}.wal.claimed-{pid of the recovering process} while replayed
+_WAL_RE = re.compile(r"^(?P<host>.+)-(?P<pid>\d+)\.wal(?:\.claimed-(?P<claimer>\d+))?$")
+
+# Errors that retrying cannot fix, e.g. a note title that is not a valid file name
+_PERMANENT_ERRNOS = {errno.ENOENT, errno.ENOTDIR, errno.EISDIR, errno.EINVAL, errno.ENAMETOOLONG}
+
+
+def _remove(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+def _is_permanent(error):
+    if isinstance(error, OSError):
+        return error.errno in _PERMANENT_ERRNOS
+    return isinstance(error, (ValueError, TypeError, KeyError))
+
+
+class _Entry:
+    """
+    Attempts of one note from one batch, with the requests waiting for them to be saved
+    """
+
+    def __init__(self, batch, note_title, attempts, futures):
+        self.batch = batch
+        self.note_title = note_title
+        self.attempts = attempts
+        self.futures = futures
+        self.tries = 0
+        self.due = 0.0
+
+
+class GroupCommitWriter:
+    """
+    Coalesces the attempts saved by concurrent requests into one storage write per note and per
+    interval. Each batch is appended to a write-ahead log and fsynced before it is written to the
+    storage; batches whose storage write was interrupted are replayed from it on the next start.
+    Every process has its own log, {host}-{pid}.wal, and recovers the logs of the dead processes of its host.
+    A note whose write keeps failing is retried a few times, without holding up the other notes,
+    then moved to dead-letter.jsonl in the same directory. If the log itself cannot be updated, the
+    requests concerned fail and the log is kept whole for the next start to replay.
+    """
+
+    def __init__(self, wal_dir, apply, interval=0.05, max_retries=5):
+        """
+        :param wal_dir: Directory of the write-ahead logs
+        :param apply: Function(note_title, attempts, retry) persisting attempts to the storage. With
+                      retry=True some of the attempts may already be saved and must not be saved twice.
+        :param interval: Seconds during which submissions are gathered into one batch
+        :param max_retries: Retries of a failed write before its attempts are dead-lettered
+        """
+        self.wal_dir = wal_dir
+        self.apply = apply
+        self.interval = interval
+        self.max_retries = max_retries
+        self.host = re.sub(r"[^A-Za-z0-9-]", "-", socket.gethostname())
+        self._condition = threading.Condition()
+        self._buffer = []
+        # Entries whose write failed, waiting for a retry, in submission order
+        self._retries = []
+        self._thread = None
+        self._stopping = False
+        self._wal = None
+        # Set when the log may hold attempts neither saved nor dead-lettered: it is not truncated
+        self._keep_wal = False
+        self._pid = None
+        self._batch = 0
+        self._stats = {"submissions": 0, "attempts": 0, "batches": 0, "writes": 0, "retries": 0,
+                       "dead_lettered": 0, "recovered": 0}
+
+    # ---------- Requests ----------
+
+    def submit(self, note_title, attempts, timeout=30):
+        """
+        Queues attempts for the next batch and waits until they are saved to the storage
+        :param note_title: Note title
+        :param attempts: Attempts in chronological order
+        :return: Number of attempts saved
+        :raise Exception: The storage error if the attempts could not be saved and were dead-lettered
+        :raise concurrent.futures.TimeoutError: If the attempts were not saved within timeout seconds.
+                                                They stay queued and may still be saved.
+        """
+        future = concurrent.futures.Future()
+        with self._condition:
+            self._ensure_started()
+            self._buffer.append((note_title, list(attempts), future))
+            self._stats["submissions"] += 1
+            self._condition.notify()
+        future.result(timeout)
+        return len(attempts)
+
+    def _ensure_started(self):
+        # A fork (e.g. several uvicorn workers) does not inherit the flusher thread nor its log
+        if self._thread is None or self._pid != os.getpid():
+            self._stopping = False
+            self._pid = os.getpid()
+            self._wal = None
+            self._keep_wal = False
+            self._retries = []
+            self._thread = threading.Thread(target=self._run, name="attempts-group-commit", daemon=True)
+            self._thread.start()
+
+    def start(self):
+        with self._condition:
+            self._ensure_started()
+
+    def stop(self, timeout=5):
+        """
+        Flushes the pending attempts then stops the flusher thread. Writes still waiting for a
+        retry stay in the write-ahead log and are replayed on the next start.
+        """
+        with self._condition:
+            thread, self._stopping = self._thread, True
+            self._condition.notify()
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    # ---------- Flushing ----------
+
+    def _wal_path(self, pid):
+        return os.path.join(self.wal_dir, f"{self.host}-{pid}.wal")
+
+    def _dead_letter_path(self):
+        return os.path.join(self.wal_dir, "dead-letter.jsonl")
+
+    def _run(self):
+        try:
+            os.makedirs(self.wal_dir, exist_ok=True)
+            self.recover()
+        except Exception as e:
+            logging.error("Error recovering the attempts write-ahead logs : %s", e)
+        while True:
+            batch = []
+            try:
+                with self._condition:
+                    while not self._buffer and not self._stopping:
+                        due = min((entry.due for entry in self._retries), default=None)
+                        if due is not None and due <= time.monotonic():
+                            break
+                        self._condition.wait(None if due is None else due - time.monotonic())
+                    if not self._buffer and self._stopping:
+                        break
+                if self._buffer:
+                    # Lets the requests arriving within the interval join this batch
+                    time.sleep(self.interval)
+                    with self._condition:
+                        batch, self._buffer = self._buffer, []
+                    self._flush(batch)
+                self._retry_due()
+            except Exception as e:
+                # The flusher must outlive any error, or every later request would wait for nothing
+                logging.error("Error in the attempts writer, failing its pending requests : %s", e)
+                self._keep_wal = True
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+        for entry in self._retries:
+            self._settle(entry, RuntimeError("The attempts writer stopped, the attempts are saved on its next start"))
+        if self._wal is not None:
+            self._wal.close()
+            if not self._retries and not self._keep_wal:
+                _remove(self._wal_path(os.getpid()))
+
+    def _flush(self, batch):
+        self._batch += 1
+        records = [(note_title, attempts) for note_title, attempts, _ in batch]
+        try:
+            if self._wal is None:
+                self._wal = open(self._wal_path(os.getpid()), "ab")
+            self._wal.write(b"".join(
+                (json.dumps({"batch": self._batch, "note": note_title, "attempt": attempt}, ensure_ascii=False) + "\n").encode("utf-8")
+                for note_title, attempts in records for attempt in attempts
+            ))
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+        except Exception as e:
+            logging.error("Error writing the attempts write-ahead log : %s", e)
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        entries = {}
+        for note_title, attempts, future in batch:
+            entry = entries.setdefault(note_title, _Entry(self._batch, note_title, [], []))
+            entry.attempts.extend(attempts)
+            entry.futures.append(future)
+        self._stats["batches"] += 1
+        self._stats["attempts"] += sum(len(entry.attempts) for entry in entries.values())
+        waiting = {entry.note_title for entry in self._retries}
+        for entry in entries.values():
+            if entry.note_title in waiting:
+                # Behind an earlier write of the same note, to keep the note's attempts in order
+                entry.due = time.monotonic()
+                self._retries.append(entry)
+            else:
+                self._write(entry)
+        self._truncate()
+
+    def _retry_due(self):
+        """
+        Retries the failed writes whose delay has elapsed, in order for each note
+        """
+        now = time.monotonic()
+        retries, self._retries = self._retries, []
+        blocked = set()
+        for entry in retries:
+            if entry.note_title in blocked or entry.due > now:
+                blocked.add(entry.note_title)
+                self._retries.append(entry)
+            elif not self._write(entry):
+                blocked.add(entry.note_title)
+        self._truncate()
+
+    def _write(self, entry):
+        """
+        Writes an entry to the storage. On failure it is queued for a retry, or dead-lettered when
+        the error is permanent or the retries are exhausted.
+        :return: True if the entry is done with, False if it was queued for a retry
+        """
+        try:
+            self.apply(entry.note_title, entry.attempts, entry.tries > 0)
+            self._stats["writes"] += 1
+            error = None
+        except Exception as e:
+            if not _is_permanent(e) and entry.tries < self.max_retries:
+                logging.error("Error saving %d attempts of %s, retrying : %s", len(entry.attempts), entry.note_title, e)
+                entry.due = time.monotonic() + min(self.interval * 2 ** entry.tries, 5)
+                entry.tries += 1
+                self._stats["retries"] += 1
+                self._retries.append(entry)
+                return False
+            error = e
+            try:
+                self._dead_letter(entry.note_title, entry.attempts, e)
+            except Exception as dead_letter_error:
+                # Left in the write-ahead log, without an "applied" record, for the next start to replay
+                logging.error("Error dead-lettering %d attempts of %s : %s", len(entry.attempts), entry.note_title,
+                              dead_letter_error)
+                self._keep_wal = True
+                self._settle(entry, error)
+                return True
+        try:
+            self._wal.write((json.dumps({"applied": entry.batch, "note": entry.note_title}, ensure_ascii=False) + "\n").encode("utf-8"))
+            self._wal.flush()
+        except Exception as e:
+            # Harmless: replaying attempts that are already saved does not save them twice
+            logging.error("Error marking attempts of %s applied in the write-ahead log : %s", entry.note_title, e)
+            self._keep_wal = True
+        self._settle(entry, error)
+        return True
+
+    @staticmethod
+    def _settle(entry, error=None):
+        for future in entry.futures:
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def _truncate(self):
+        # Everything logged is in the storage or the dead letters now
+        if not self._retries and not self._keep_wal and self._wal is not None:
+            self._wal.truncate(0)
+
+    def _dead_letter(self, note_title, attempts, error):
+        logging.error("Giving up saving %d attempts of %s, moved to %s : %s", len(attempts), note_title,
+                      self._dead_letter_path(), error)
+        with open(self._dead_letter_path(), "ab") as file:
+            file.write((json.dumps({"note": note_title, "attempts": attempts, "error": repr(error)}, ensure_ascii=False) + "\n").encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+        self._stats["dead_lettered"] += len(attempts)
+
+    # ---------- Recovery ----------
+
+    def recover(self):
+        """
+        Replays the batches logged but not applied by the dead processes of this host
+        :return: Number of attempts replayed
+        """
+        recovered = 0
+        for filename in os.listdir(self.wal_dir) if os.path.isdir(self.wal_dir) else ():
+            match = _WAL_RE.match(filename)
+            if not match or match.group("host") != self.host:
+                continue
+            pid = int(match.group("claimer") or match.group("pid"))
+            if match.group("claimer"):
+                # Being replayed by a live process, or by another thread of this one
+                if pid == os.getpid() or _pid_alive(pid):
+                    continue
+            # Skips the logs of live processes, this one's included once its flusher runs
+            elif (_pid_alive(pid) if pid != os.getpid() else self._wal is not None):
+                continue
+            # Claimed by renaming, so that workers starting together never replay the same log twice
+            path = os.path.join(self.wal_dir, filename)
+            claimed = os.path.join(self.wal_dir, f"{match.group('host')}-{match.group('pid')}.wal.claimed-{os.getpid()}")
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                recovered += self._replay(claimed)
+            except Exception as e:
+                # Left claimed: recovered again once this process is gone
+                logging.error("Error replaying the write-ahead log %s : %s", claimed, e)
+        if recovered:
+            logging.info("Recovered %d attempts from the write-ahead logs", recovered)
+        self._stats["recovered"] += recovered
+        return recovered
+
+    def _replay(self, path):
+        pending = defaultdict(list)
+        with open(path, "rb") as file:
+            for line in file.read().decode("utf-8").splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn by the crash: this batch was never written to the storage
+                    continue
+                if "applied" in record:
+                    pending.pop((record["applied"], record["note"]), None)
+                else:
+                    pending[(record["batch"], record["note"])].append(record["attempt"])
+        for (_, note_title), attempts in sorted(pending.items(), key=lambda item: item[0][0]):
+            self._replay_entry(note_title, attempts)
+        _remove(path)
+        return sum(len(attempts) for attempts in pending.values())
+
+    def _replay_entry(self, note_title, attempts):
+        # The crash may have happened after the write but before its "applied" record
+        for tries in range(self.max_retries + 1):
+            try:
+                self.apply(note_title, attempts, True)
+                self._stats["writes"] += 1
+                return
+            except Exception as e:
+                if _is_permanent(e) or tries == self.max_retries:
+                    self._dead_letter(note_title, attempts, e)
+                    return
+                logging.error("Error replaying %d attempts of %s, retrying : %s", len(attempts), note_title, e)
+                time.sleep(min(self.interval * 2 ** tries, 5))
+
+    def get_stats(self):
+        """
+        :return: Counters of submissions, attempts, batches, storage writes, retries and dead-lettered
+                 attempts, and the attempts pending
+        """
+        with self._condition:
+            pending = sum(len(attempts) for _, attempts, _ in self._buffer)
+        return {**self._stats, "pending": pending, "retrying": sum(len(entry.attempts) for entry in list(self._retries))}
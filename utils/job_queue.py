@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from storage.sqlite import ThreadLocalConnections
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    dedupe_key TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Persistent job queue backed by SQLite and run by a bounded pool of worker threads.
+    Jobs left running by a process that died are queued again when the pool starts.
+    """
+
+    def __init__(self, path, workers=2, poll_interval=1.0, retention=24 * 3600):
+        self.path = path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.db = ThreadLocalConnections(path, SCHEMA)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers = {}
+        self._threads = []
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._coalesced = 0
+        self._upgrade_schema()
+
+    def _upgrade_schema(self):
+        conn = self.db.get()
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "dedupe_key" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(kind, dedupe_key) WHERE dedupe_key IS NOT NULL")
+
+    def register(self, kind, handler):
+        """
+        :param kind: Job type
+        :param handler: Function called with the job payload, returning a JSON-serializable result
+        """
+        self._handlers[kind] = handler
+
+    def submit(self, kind, payload, dedupe_key=None):
+        """
+        Queues a job
+        :param dedupe_key: If a queued or running job of the same kind has this key, its id is
+                           returned instead of queuing a duplicate
+        :return: Job id
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        with self.db.transaction() as conn:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND dedupe_key = ? AND status IN (?, ?) LIMIT 1",
+                    (kind, dedupe_key, QUEUED, RUNNING),
+                ).fetchone()
+                if row is not None:
+                    with self._stats_lock:
+                        self._coalesced += 1
+                    return row[0]
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, dedupe_key, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, dedupe_key, time.time()),
+            )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """
+        :return: Job status, result and error, or None if the job is unknown
+        """
+        row = self.db.get().execute(
+            "SELECT id, kind, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, result, error, created_at, started_at, finished_at = row
+        return {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+
+    def get_stats(self):
+        rows = self.db.get().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        with self._stats_lock:
+            coalesced = self._coalesced
+        return {"workers": self.workers, "coalesced": coalesced, **{status: count for status, count in rows}}
+
+    # ---------- Workers ----------
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._requeue_orphans()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info("Job queue started with %d workers", self.workers)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _requeue_orphans(self):
+        """
+        Queues again the jobs whose owning process on this host is gone
+        """
+        host = socket.gethostname()
+        rows = self.db.get().execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        for job_id, owner in rows:
+            owner_host, _, owner_pid = (owner or "").rpartition(":")
+            if owner_host == host and owner_pid.isdigit() and _pid_alive(int(owner_pid)) and owner != self.owner:
+                continue
+            self.db.get().execute(
+                "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL WHERE id = ? AND status = ?",
+                (QUEUED, job_id, RUNNING),
+            )
+            logging.info("Requeued interrupted job %s", job_id)
+
+    def _claim(self):
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = ?, started_at = ? WHERE id = ?",
+                (RUNNING, self.owner, time.time(), row[0]),
+            )
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self.db.get().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def _purge_finished(self):
+        self.db.get().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - self.retention),
+        )
+
+    def _run(self):
+        last_purge = 0
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logging.error("Error claiming a job : %s", e)
+                job = None
+            if job is None:
+                if time.time() - last_purge > 60:
+                    self._purge_finished()
+                    last_purge = time.time()
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            job_id, kind, payload = job
+            try:
+                result = self._handlers[kind](json.loads(payload))
+            except Exception as e:
+                logging.exception("Job %s (%s) failed", job_id, kind)
+                self._finish(job_id, FAILED, error=str(e) or type(e).__name__)
+            else:
+                self._finish(job_id, DONE, result=result)
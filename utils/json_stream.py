@@ -0,0 +1,67 @@
+import json
+
+
+class JSONArrayStream:
+    """
+    Incremental parser for a JSON array of objects arriving in chunks, such as a streamed
+    model completion. Each element is returned as soon as its closing brace is received.
+    Text before the opening bracket (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._position = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element_start = None
+        self.finished = False
+
+    def feed(self, chunk):
+        """
+        :param chunk: Next piece of text
+        :return: List of the elements completed by this chunk
+        """
+        self._buffer += chunk
+        elements = []
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer) and not self.finished:
+            char = buffer[position]
+            if not self._started:
+                if char == "[":
+                    self._started = True
+                position += 1
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._element_start = position
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0 and char == "]":
+                    self.finished = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        elements.append(json.loads(buffer[self._element_start:position + 1]))
+                        self._element_start = None
+            position += 1
+
+        # Drop the text that no pending element refers to
+        keep_from = self._element_start if self._element_start is not None else position
+        self._buffer = buffer[keep_from:]
+        self._position = position - keep_from
+        if self._element_start is not None:
+            self._element_start = 0
+        return elements
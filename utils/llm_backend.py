@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import httpx
+from openai import DefaultAsyncHttpxClient
+
+LIVE, RECORD, REPLAY = "live", "record", "replay"
+
+
+def cassette_key(request_body):
+    """
+    Identifies an LLM request by its canonical JSON body (model, messages, stream flag...)
+    :param request_body: Raw body sent to the provider
+    :return: sha256 hex digest
+    """
+    try:
+        canonical = json.dumps(json.loads(request_body), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        canonical = request_body.decode("utf-8", errors="replace")
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _cassette_path(cassette_dir, key):
+    return os.path.join(cassette_dir, f"{key}.json")
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Forwards requests to the provider and writes each request/response pair to a cassette.
+    Streamed responses are read in full before being returned, so they arrive all at once.
+    """
+
+    def __init__(self, cassette_dir, transport=None):
+        self.cassette_dir = cassette_dir
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    async def handle_async_request(self, request):
+        body = await request.aread()
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        content = await response.aread()
+        latency = time.perf_counter() - started
+
+        key = cassette_key(body)
+        cassette = {
+            "request": json.loads(body) if body else None,
+            "status": response.status_code,
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() in ("content-type", "retry-after")},
+            "body": content.decode("utf-8"),
+            "latency": latency,
+        }
+        path = _cassette_path(self.cassette_dir, key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(cassette, file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+        logging.info("Recorded LLM cassette %s (%d)", key, response.status_code)
+
+        return httpx.Response(response.status_code, headers=cassette["headers"], content=content, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class _DelayedStream(httpx.AsyncByteStream):
+    """
+    Replays a server-sent event body one event at a time, spreading the latency over the events
+    """
+
+    def __init__(self, content, latency):
+        self.events = [event + b"\n\n" for event in content.split(b"\n\n") if event.strip()]
+        self.delay = latency / max(len(self.events), 1)
+
+    async def __aiter__(self):
+        for event in self.events:
+            await asyncio.sleep(self.delay)
+            yield event
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Serves recorded cassettes without any network access. Unknown requests get a 404.
+    :param latency: Simulated latency in seconds, or None to reproduce the recorded latency
+    :param jitter: Relative random variation applied to the latency (0.2 = +/- 20%)
+    """
+
+    def __init__(self, cassette_dir, latency=0.0, jitter=0.0):
+        self.cassette_dir = cassette_dir
+        self.latency = latency
+        self.jitter = jitter
+        self._cassettes = {}
+
+    def _load(self, key):
+        cassette = self._cassettes.get(key)
+        if cassette is None:
+            try:
+                with open(_cassette_path(self.cassette_dir, key), "r", encoding="utf-8") as file:
+                    cassette = json.load(file)
+            except FileNotFoundError:
+                return None
+            self._cassettes[key] = cassette
+        return cassette
+
+    async def handle_async_request(self, request):
+        key = cassette_key(await request.aread())
+        cassette = self._load(key)
+        if cassette is None:
+            logging.error("No LLM cassette for request %s", key)
+            return httpx.Response(
+                404, json={"error": {"message": f"No cassette recorded for this request ({key})"}}, request=request
+            )
+
+        latency = cassette["latency"] if self.latency is None else self.latency
+        latency *= 1 + random.uniform(-self.jitter, self.jitter)
+        content = cassette["body"].encode("utf-8")
+        if cassette["headers"].get("content-type", "").startswith("text/event-stream"):
+            return httpx.Response(cassette["status"], headers=cassette["headers"],
+                                  stream=_DelayedStream(content, latency), request=request)
+        await asyncio.sleep(latency)
+        return httpx.Response(cassette["status"], headers=cassette["headers"], content=content, request=request)
+
+
+def make_http_client(mode, cassette_dir, latency=0.0, jitter=0.0):
+    """
+    :param mode: LIVE, RECORD or REPLAY
+    :return: httpx.AsyncClient for the OpenAI client, or None to use its default client in live mode
+    """
+    if mode == LIVE:
+        return None
+    if mode == RECORD:
+        return DefaultAsyncHttpxClient(transport=RecordingTransport(cassette_dir))
+    if mode == REPLAY:
+        return DefaultAsyncHttpxClient(transport=ReplayTransport(cassette_dir, latency=latency, jitter=jitter))
+    raise ValueError(f"Unknown LLM mode: {mode}")
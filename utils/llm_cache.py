@@ -0,0 +1,168 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from storage.sqlite import ThreadLocalConnections
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    latency REAL NOT NULL,
+    version TEXT NOT NULL DEFAULT ''
+);
+
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access);
+"""
+
+
+def make_key(*parts):
+    """
+    Builds a cache key from the parts that determine an LLM result
+    :param parts: Strings such as the model, the prompt version and the input text
+    :return: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent cache of LLM results stored in SQLite, evicted in LRU order
+    once it holds more than max_entries entries or max_bytes bytes of values.
+    Entries can also expire after ttl seconds. The most recently used entries
+    are kept in memory so repeated lookups do not touch the database.
+    Entries written under another version (e.g. a previous prompt) are purged on startup.
+    """
+
+    def __init__(self, path, max_entries=1000, max_bytes=50 * 1024 * 1024, ttl=None, memory_entries=0, version=""):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.version = version
+        self.db = ThreadLocalConnections(path, SCHEMA)
+        self._memory = OrderedDict()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "memory_hits": 0, "misses": 0, "evictions": 0, "latency_saved": 0.0}
+        self._upgrade_schema()
+        self.db.get().execute("DELETE FROM entries WHERE version != ?", (version,))
+
+    def _upgrade_schema(self):
+        columns = [row[1] for row in self.db.get().execute("PRAGMA table_info(entries)")]
+        if "version" not in columns:
+            self.db.get().execute("ALTER TABLE entries ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+
+    def _remember(self, key, value, expires_at, latency):
+        if not self.memory_entries:
+            return
+        self._memory[key] = (value, expires_at, latency)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        :return: The cached value, or None on a miss
+        """
+        now = time.time()
+        with self._stats_lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                value, expires_at, latency = cached
+                if expires_at is None or expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    self._stats["latency_saved"] += latency
+                    return value
+                del self._memory[key]
+
+        conn = self.db.get()
+        row = conn.execute("SELECT value, latency, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is not None and self.ttl is not None and row[2] + self.ttl <= now:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            with self._stats_lock:
+                self._stats["misses"] += 1
+            return None
+        conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        value = json.loads(row[0])
+        with self._stats_lock:
+            self._stats["hits"] += 1
+            self._stats["latency_saved"] += row[1]
+            self._remember(key, value, row[2] + self.ttl if self.ttl is not None else None, row[1])
+        return value
+
+    def put(self, key, value, latency=0.0):
+        """
+        Stores a value then evicts the least recently used entries if the cache is over budget
+        :param key: Cache key
+        :param value: JSON-serializable value
+        :param latency: Seconds the LLM call took, credited as saved time on each hit
+        """
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created_at, last_access, latency, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, data, len(data.encode("utf-8")), now, now, latency, self.version),
+            )
+            self._evict(conn)
+        with self._stats_lock:
+            self._remember(key, json.loads(data), now + self.ttl if self.ttl is not None else None, latency)
+
+    def _evict(self, conn):
+        evicted = 0
+        if self.ttl is not None:
+            evicted += conn.execute("DELETE FROM entries WHERE created_at <= ?", (time.time() - self.ttl,)).rowcount
+        count, total_size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        while count > self.max_entries or total_size > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            count -= 1
+            total_size -= row[1]
+            evicted += 1
+            with self._stats_lock:
+                self._memory.pop(row[0], None)
+        if evicted:
+            with self._stats_lock:
+                self._stats["evictions"] += evicted
+
+    def delete(self, key):
+        with self._stats_lock:
+            self._memory.pop(key, None)
+        self.db.get().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._stats_lock:
+            self._memory.clear()
+        self.db.get().execute("DELETE FROM entries")
+
+    def get_stats(self):
+        """
+        :return: Hit/miss counters, hit rate, seconds of LLM latency saved and current size
+        """
+        count, total_size = self.db.get().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["latency_saved"] = round(stats["latency_saved"], 3)
+        stats["entries"] = count
+        stats["bytes"] = total_size
+        return stats
@@ -0,0 +1,146 @@
+import os
+import asyncio
+import time
+import weakref
+from urllib.parse import urlparse
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from config import (LLM_MODEL, LLM_BASE_URL, LLM_MODE, LLM_CASSETTE_DIR, LLM_REPLAY_LATENCY, LLM_REPLAY_JITTER,
+                    LLM_MAX_CONCURRENCY, LLM_TIMEOUT, LLM_RATE_LIMIT, LLM_BURST,
+                    LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX, LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET,
+                    LLM_INTERACTIVE_DEADLINE, LLM_BULK_DEADLINE)
+from utils.llm_backend import make_http_client
+from utils.llm_scheduler import LLMScheduler, LLMUnavailableError, INTERACTIVE, BULK
+
+# Load environment variables
+load_dotenv()
+
+# API configuration
+api_key = os.getenv("DEEPSEEK_KEY")
+
+# Only the provider needs a key: replayed cassettes and a local stub server accept any value
+if LLM_MODE in ("live", "record") and urlparse(LLM_BASE_URL).hostname not in ("localhost", "127.0.0.1", "::1"):
+    if not api_key:
+        raise ValueError("DEEPSEEK_KEY environment variable is not set!")
+else:
+    api_key = api_key or "offline"
+
+# AsyncOpenAI clients are bound to the event loop they were first used in, so one is kept
+# per loop (the uvicorn loop, plus any loop started by asyncio.run). The scheduler is shared
+# by all of them so the provider quota and the concurrency limit apply to the whole process.
+_clients = weakref.WeakKeyDictionary()
+
+scheduler = LLMScheduler(
+    rate=LLM_RATE_LIMIT,
+    burst=LLM_BURST,
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    max_retries=LLM_MAX_RETRIES,
+    backoff_base=LLM_BACKOFF_BASE,
+    backoff_max=LLM_BACKOFF_MAX,
+    failure_threshold=LLM_BREAKER_THRESHOLD,
+    reset_timeout=LLM_BREAKER_RESET,
+)
+
+DEADLINES = {INTERACTIVE: LLM_INTERACTIVE_DEADLINE, BULK: LLM_BULK_DEADLINE}
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            base_url=LLM_BASE_URL,
+            api_key=api_key,
+            # Retries are handled by the scheduler
+            max_retries=0,
+            http_client=make_http_client(
+                LLM_MODE,
+                LLM_CASSETTE_DIR,
+                latency=None if LLM_REPLAY_LATENCY == "recorded" else float(LLM_REPLAY_LATENCY),
+                jitter=LLM_REPLAY_JITTER,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _deadline(priority, deadline):
+    return time.monotonic() + (deadline if deadline is not None else DEADLINES[priority])
+
+
+async def chat_completion(prompt, timeout=LLM_TIMEOUT, priority=INTERACTIVE, deadline=None):
+    """
+    Sends a single-message chat completion through the scheduler
+    :param prompt: User message
+    :param timeout: Seconds allowed for each attempt once it has been admitted
+    :param priority: INTERACTIVE (a user is waiting) or BULK (background work)
+    :param deadline: Seconds the request may take in total, queueing and retries included.
+                     Defaults to LLM_INTERACTIVE_DEADLINE or LLM_BULK_DEADLINE.
+    :return: ChatCompletion response
+    :raises LLMUnavailableError: The provider could not serve the request in time
+    """
+    return await scheduler.submit(
+        lambda: get_async_client().chat.completions.create(
+            extra_body={},
+            model=LLM_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+        ),
+        priority=priority,
+        deadline=_deadline(priority, deadline),
+        timeout=timeout,
+    )
+
+
+async def stream_chat_completion(prompt, timeout=LLM_TIMEOUT, priority=INTERACTIVE, deadline=None):
+    """
+    Streams a single-message chat completion, yielding the text deltas as they arrive.
+    The stream holds its scheduler slot until it ends; it is retried only if it fails
+    before the first delta was yielded.
+    :param prompt: User message
+    :param timeout: Seconds allowed for the whole stream once it has been admitted
+    :param priority: INTERACTIVE or BULK
+    :param deadline: Seconds the request may take in total, queueing and retries included
+    :return: Async generator of text chunks
+    :raises LLMUnavailableError: The provider could not serve the request in time
+    """
+    deadline = _deadline(priority, deadline)
+    attempt = 0
+    yielded = False
+    while True:
+        try:
+            async with scheduler.attempt(priority, deadline):
+                stop_at = min(time.monotonic() + timeout, deadline)
+                stream = await asyncio.wait_for(
+                    get_async_client().chat.completions.create(
+                        extra_body={},
+                        model=LLM_MODEL,
+                        messages=[{"role": "user", "content": prompt}],
+                        stream=True,
+                    ),
+                    max(stop_at - time.monotonic(), 0),
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(stop_at - time.monotonic(), 0))
+                    except StopAsyncIteration:
+                        break
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yielded = True
+                        yield chunk.choices[0].delta.content
+            return
+        except LLMUnavailableError:
+            raise
+        except Exception as error:
+            if yielded:
+                raise
+            await scheduler.backoff(error, attempt, deadline)
+            attempt += 1
+
+
+def get_llm_stats():
+    """
+    Returns the scheduler counters: completed, failed, retried and rejected calls, queue
+    lengths per lane, circuit breaker state and remaining rate limit tokens
+    """
+    return scheduler.get_stats()
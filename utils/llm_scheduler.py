@@ -0,0 +1,340 @@
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+from contextlib import asynccontextmanager
+import openai
+
+# Priority lanes: lower values are served first
+INTERACTIVE, BULK = 0, 1
+LANES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class LLMUnavailableError(Exception):
+    """
+    The LLM could not serve the request: upstream down, rate limited past the deadline or retries exhausted
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class DeadlineExceededError(LLMUnavailableError):
+    pass
+
+
+def _retry_after(error):
+    """
+    :return: Seconds requested by the provider's Retry-After header, if any
+    """
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def classify(error):
+    """
+    :return: (retryable, upstream_failure) for an exception raised by an LLM call.
+             Rate limits are retryable but do not count against the circuit breaker.
+    """
+    if isinstance(error, openai.RateLimitError):
+        return True, False
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError,
+                          asyncio.TimeoutError)):
+        return True, True
+    return False, False
+
+
+class TokenBucket:
+    """
+    Request rate limiter: refills at rate tokens per second up to capacity.
+    Not thread-safe on its own, the scheduler lock protects it.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """
+        :return: 0 if a token was taken, otherwise the seconds until one is available
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, now, seconds):
+        """
+        Stops handing out tokens for a while, e.g. after the provider answered 429
+        """
+        self._refill(now)
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+
+class LLMScheduler:
+    """
+    Admission control shared by every LLM call of the process, whatever event loop it runs in.
+    Calls wait for a token of the rate limiter and a concurrency slot, interactive calls ahead
+    of bulk ones, and give up once their deadline has passed. Failed calls are retried with
+    jittered exponential backoff; consecutive upstream failures open a circuit breaker so that
+    further calls fail fast until a probe call succeeds.
+    """
+
+    def __init__(self, rate, burst, max_concurrency, max_retries=4, backoff_base=0.5, backoff_max=20.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.bucket = TokenBucket(rate, burst)
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._stats = {"completed": 0, "failed": 0, "timeouts": 0, "retries": 0, "rate_limited": 0,
+                       "deadline_exceeded": 0, "rejected": 0, "circuit_opened": 0}
+
+    # ---------- Admission ----------
+
+    def _notify_head(self):
+        if not self._waiters:
+            return
+        waiter = self._waiters[0][2]
+        future = waiter.future
+        try:
+            waiter.loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+        except RuntimeError:
+            # The waiter's loop is closed, it will never wake up again
+            pass
+
+    def _try_admit(self, entry, now):
+        """
+        :return: 0 if the call was admitted, the seconds until it may be, or None to wait for a release
+        """
+        if self._waiters[0] is not entry or self._in_flight >= self.max_concurrency:
+            return None
+        wait = self.bucket.take(now)
+        if wait:
+            return wait
+        heapq.heappop(self._waiters)
+        self._in_flight += 1
+        self._notify_head()
+        return 0
+
+    def _check_circuit(self, now):
+        if self._state == OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError("LLM provider unavailable (circuit open)",
+                                       retry_after=self.reset_timeout - (now - self._opened_at))
+            self._state = HALF_OPEN
+        if self._state == HALF_OPEN:
+            if self._probing:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError("LLM provider unavailable (probing)", retry_after=1.0)
+            self._probing = True
+            return True
+        return False
+
+    async def _acquire(self, priority, deadline):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop)
+        entry = (priority, next(self._sequence), waiter)
+        with self._lock:
+            heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    wait = self._try_admit(entry, now)
+                    if wait == 0:
+                        return
+                    if waiter.future.done():
+                        waiter.future = loop.create_future()
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise DeadlineExceededError("LLM request deadline exceeded while queued")
+                await asyncio.wait({waiter.future}, timeout=remaining if wait is None else min(wait, remaining))
+        except BaseException:
+            with self._lock:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._notify_head()
+            raise
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._notify_head()
+
+    # ---------- Outcomes ----------
+
+    def _record(self, error, probe):
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+            if error is None:
+                self._stats["completed"] += 1
+                self._failures = 0
+                if self._state != CLOSED:
+                    logging.info("LLM circuit closed")
+                self._state = CLOSED
+                return
+            if isinstance(error, LLMUnavailableError):
+                return
+            self._stats["failed"] += 1
+            if isinstance(error, asyncio.TimeoutError):
+                self._stats["timeouts"] += 1
+            if isinstance(error, openai.RateLimitError):
+                self._stats["rate_limited"] += 1
+                self.bucket.pause(now, _retry_after(error) or self.backoff_base)
+            _, upstream_failure = classify(error)
+            if not upstream_failure:
+                return
+            self._failures += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = now
+                self._stats["circuit_opened"] += 1
+                logging.error("LLM circuit opened after %d consecutive failures", self._failures)
+
+    @asynccontextmanager
+    async def attempt(self, priority, deadline):
+        """
+        Runs one call attempt: fails fast if the circuit is open, waits for admission,
+        then records the outcome and frees the slot
+        :param priority: INTERACTIVE or BULK
+        :param deadline: time.monotonic() value after which the call is abandoned
+        """
+        with self._lock:
+            probe = self._check_circuit(time.monotonic())
+        try:
+            await self._acquire(priority, deadline)
+        except BaseException:
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        try:
+            yield
+        except Exception as error:
+            self._record(error, probe)
+            raise
+        except BaseException:
+            # Cancelled or closed by the caller: neither a success nor an upstream failure
+            if probe:
+                with self._lock:
+                    self._probing = False
+            raise
+        else:
+            self._record(None, probe)
+        finally:
+            self._release()
+
+    async def backoff(self, error, attempt, deadline):
+        """
+        Sleeps before retrying a failed attempt, or raises if it should not be retried
+        :param error: Exception raised by the attempt
+        :param attempt: Number of attempts already made, minus one
+        :param deadline: time.monotonic() value after which the call is abandoned
+        """
+        retryable, _ = classify(error)
+        if not retryable:
+            raise error
+        if attempt >= self.max_retries:
+            raise LLMUnavailableError(f"LLM call failed after {attempt + 1} attempts: {error}") from error
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        delay = max(delay, _retry_after(error) or 0)
+        if time.monotonic() + delay >= deadline:
+            with self._lock:
+                self._stats["deadline_exceeded"] += 1
+            raise DeadlineExceededError(f"LLM request deadline exceeded after {attempt + 1} attempts: {error}",
+                                        retry_after=delay) from error
+        with self._lock:
+            self._stats["retries"] += 1
+        logging.warning("LLM call failed (%s), retrying in %.2fs", str(error) or type(error).__name__, delay)
+        await asyncio.sleep(delay)
+
+    async def submit(self, call, priority=INTERACTIVE, deadline=None, timeout=None):
+        """
+        Runs call() under admission control, retrying retryable failures until the deadline
+        :param call: Function returning a new awaitable for each attempt
+        :param priority: INTERACTIVE or BULK
+        :param deadline: time.monotonic() value after which the call is abandoned
+        :param timeout: Seconds allowed for each attempt once admitted
+        :return: Result of the first successful attempt
+        """
+        deadline = deadline if deadline is not None else time.monotonic() + (timeout or 60)
+        attempt = 0
+        while True:
+            try:
+                async with self.attempt(priority, deadline):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise DeadlineExceededError("LLM request deadline exceeded")
+                    return await asyncio.wait_for(call(), min(timeout, remaining) if timeout else remaining)
+            except DeadlineExceededError:
+                with self._lock:
+                    self._stats["deadline_exceeded"] += 1
+                raise
+            except Exception as error:
+                await self.backoff(error, attempt, deadline)
+                attempt += 1
+
+    def get_stats(self):
+        now = time.monotonic()
+        with self._lock:
+            queued = {name: 0 for name in LANES.values()}
+            for priority, _, _ in self._waiters:
+                queued[LANES[priority]] += 1
+            self.bucket._refill(now)
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "queued": queued,
+                "circuit": self._state,
+                "consecutive_failures": self._failures,
+                "tokens": round(self.bucket.tokens, 2),
+                "max_concurrency": self.max_concurrency,
+            }
@@ -1,26 +1,175 @@
-import os
-from config import NOTES_DIR  
+import hashlib
+import logging
+import threading
+from storage import get_storage
+from utils import search_index
+
+# In-memory note cache: title -> {"mtime": ns, "size": bytes, "content": str, "hash": sha256}
+# An entry is reused as long as the storage reports the same mtime and size for the note.
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _read_cached(title, version=None):
+    """
+    Returns the cache entry of a note, re-reading it only if its mtime or size changed
+    :param title: Note title
+    :param version: (mtime_ns, size) already known for the note, fetched from storage if None
+    :return: Cache entry, or None if the note does not exist
+    """
+    storage = get_storage()
+    if version is None:
+        version = storage.stat_note(title)
+    if version is None:
+        if _cache.pop(title, None) is not None:
+            _cache_stats["invalidations"] += 1
+        return None
+
+    entry = _cache.get(title)
+    if entry and (entry["mtime"], entry["size"]) == tuple(version):
+        _cache_stats["hits"] += 1
+        return entry
+
+    _cache_stats["misses"] += 1
+    content = storage.read_note(title)
+    if content is None:
+        _cache.pop(title, None)
+        return None
+    entry = {"mtime": version[0], "size": version[1], "content": content, "hash": _content_hash(content)}
+    _cache[title] = entry
+    return entry
+
+
+def _store_cached(title, content, version):
+    """
+    Puts freshly written content in the cache so the next read is a hit
+    """
+    _cache[title] = {"mtime": version[0], "size": version[1], "content": content, "hash": _content_hash(content)}
+
 
 def load_notes():
     notes = []
-    if not os.path.exists(NOTES_DIR):
-        os.makedirs(NOTES_DIR)
-    for filename in os.listdir(NOTES_DIR):
-        if filename.endswith(".txt"):
-            with open(os.path.join(NOTES_DIR, filename), "r") as file:
-                notes.append({"title": filename.replace(".txt", ""), "content": file.read()})
+    with _cache_lock:
+        versions = get_storage().stat_notes()
+        for title in [t for t in _cache if t not in versions]:
+            del _cache[title]
+            _cache_stats["invalidations"] += 1
+        for title, version in versions.items():
+            entry = _read_cached(title, version)
+            if entry is not None:
+                notes.append({"title": title, "content": entry["content"]})
     return notes
 
+def iter_notes():
+    """
+    Yields notes one at a time, reading each note only when it is emitted
+    Notes that are already cached and up to date are served from the cache,
+    other notes are read without being added to it so memory stays flat.
+    :return: Generator of {"title", "content"} dictionaries
+    """
+    storage = get_storage()
+    with _cache_lock:
+        titles = list(storage.stat_notes())
+    for title in titles:
+        version = storage.stat_note(title)
+        if version is None:
+            continue
+        with _cache_lock:
+            entry = _cache.get(title)
+            if entry and (entry["mtime"], entry["size"]) == tuple(version):
+                _cache_stats["hits"] += 1
+                content = entry["content"]
+            else:
+                content = None
+        if content is None:
+            content = storage.read_note(title)
+            if content is None:
+                continue
+        yield {"title": title, "content": content}
+
+def list_notes_metadata(limit=None, cursor=None):
+    """
+    Lists notes without their content, sorted by title
+    :param limit: Maximum number of notes to return, None for all
+    :param cursor: Title after which the listing starts (exclusive)
+    :return: Dictionary with the notes metadata and the cursor of the next page
+    """
+    storage = get_storage()
+    with _cache_lock:
+        versions = storage.stat_notes()
+    titles = sorted(versions)
+    if cursor is not None:
+        titles = [title for title in titles if title > cursor]
+    notes = []
+    has_more = False
+    for title in titles:
+        if limit is not None and len(notes) >= limit:
+            has_more = True
+            break
+        version = tuple(versions[title])
+        with _cache_lock:
+            entry = _cache.get(title)
+            if entry and (entry["mtime"], entry["size"]) == version:
+                _cache_stats["hits"] += 1
+            else:
+                entry = None
+        if entry is None:
+            # Read and hashed outside the lock so that other note operations are not held up
+            content = storage.read_note(title)
+            if content is None:
+                continue
+            entry = {"mtime": version[0], "size": version[1], "content": content, "hash": _content_hash(content)}
+            with _cache_lock:
+                _cache_stats["misses"] += 1
+                _cache[title] = entry
+        notes.append({
+            "title": title,
+            "size": entry["size"],
+            "mtime": entry["mtime"] / 1e9,
+            "hash": entry["hash"],
+        })
+    return {"notes": notes, "next_cursor": notes[-1]["title"] if has_more and notes else None}
+
+def get_note(title):
+    """
+    Retrieves a single note
+    :param title: Note title
+    :return: The note with its content, or None if it does not exist
+    """
+    with _cache_lock:
+        entry = _read_cached(title)
+    if entry is None:
+        return None
+    return {"title": title, "content": entry["content"], "hash": entry["hash"]}
+
+def _update_search_index(title, content=None, version=None):
+    """
+    Reflects a write in the search index; a failure there must not fail the write itself
+    """
+    try:
+        if content is None:
+            search_index.remove_note(title)
+        else:
+            search_index.index_note(title, content, version)
+    except Exception as e:
+        logging.error("Error updating search index for %s : %s", title, e)
+
 def save_note(title, content):
-    if not os.path.exists(NOTES_DIR):
-        os.makedirs(NOTES_DIR)
-    with open(os.path.join(NOTES_DIR, f"{title}.txt"), "w") as file:
-        file.write(content)
+    with _cache_lock:
+        version = get_storage().write_note(title, content)
+        _store_cached(title, content, version)
+    _update_search_index(title, content, version)
 
 def delete_note(title):
-    filepath = os.path.join(NOTES_DIR, f"{title}.txt")
-    if os.path.exists(filepath):
-        os.remove(filepath)
+    with _cache_lock:
+        get_storage().delete_note(title)
+        _cache.pop(title, None)
+    _update_search_index(title)
 
 def update_note(title, new_content):
     """
@@ -29,9 +178,29 @@ def update_note(title, new_content):
     :param new_content: New content
     :return: True if update successful, False otherwise
     """
-    filepath = os.path.join(NOTES_DIR, f"{title}.txt")
-    if os.path.exists(filepath):
-        with open(filepath, "w") as file:
-            file.write(new_content)
-        return True
-    return False
+    storage = get_storage()
+    with _cache_lock:
+        if storage.stat_note(title) is not None:
+            version = storage.write_note(title, new_content)
+            _store_cached(title, new_content, version)
+        else:
+            return False
+    _update_search_index(title, new_content, version)
+    return True
+
+def get_cache_stats():
+    """
+    Returns the note cache counters
+    :return: Dictionary with hits, misses, invalidations and cached note count
+    """
+    with _cache_lock:
+        return {**_cache_stats, "cached_notes": len(_cache)}
+
+def clear_cache():
+    """
+    Empties the note cache and resets its counters
+    """
+    with _cache_lock:
+        _cache.clear()
+        for key in _cache_stats:
+            _cache_stats[key] = 0
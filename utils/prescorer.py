@@ -0,0 +1,112 @@
+import zlib
+import threading
+import numpy as np
+from config import PRESCORER_ENABLED, PRESCORER_LOW, PRESCORER_HIGH, PRESCORER_WEIGHTS
+from utils.text_utils import tokenize, fold_accents
+
+# Words ignored when extracting the keywords of a reference answer
+STOPWORDS = frozenset("""
+le la les un une des du de d l et ou en au aux ce ces cet cette il elle ils elles on est sont
+a ont pour par sur dans avec sans qui que quoi dont ne pas plus se sa son ses leur leurs
+the a an of to in on for and or is are be by with as at it its this that from
+""".split())
+
+NGRAM_SIZE = 3
+NGRAM_BINS = 1 << 12
+
+_stats_lock = threading.Lock()
+_stats = {"total": 0, "short_circuited": 0, "blank": 0, "low": 0, "high": 0}
+
+
+def _token_ids(tokens):
+    return np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens), dtype=np.uint32, count=len(tokens))
+
+
+def _ngram_vector(text):
+    """
+    Hashed character n-gram counts of the folded text
+    """
+    text = f" {' '.join(fold_accents(text).split())} "
+    if len(text) < NGRAM_SIZE:
+        return np.zeros(NGRAM_BINS, dtype=np.float32)
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    # Polynomial hash of every window of NGRAM_SIZE code points
+    hashes = np.zeros(len(codes) - NGRAM_SIZE + 1, dtype=np.uint64)
+    for offset in range(NGRAM_SIZE):
+        hashes = hashes * np.uint64(1000003) + codes[offset:len(codes) - NGRAM_SIZE + 1 + offset]
+    return np.bincount((hashes % np.uint64(NGRAM_BINS)).astype(np.int64), minlength=NGRAM_BINS).astype(np.float32)
+
+
+def features(user_answer, correct_answer):
+    """
+    Lexical similarity features between an answer and the reference answer, each in [0, 1]
+    :return: Array [token_overlap, keyword_recall, ngram_similarity]
+    """
+    answer_ids = np.unique(_token_ids(tokenize(user_answer or "")))
+    reference_tokens = tokenize(correct_answer or "")
+    reference_ids = np.unique(_token_ids(reference_tokens))
+
+    union = np.union1d(answer_ids, reference_ids).size
+    token_overlap = np.intersect1d(answer_ids, reference_ids, assume_unique=True).size / union if union else 0.0
+
+    keywords = [token for token in reference_tokens if len(token) > 2 and token not in STOPWORDS]
+    keyword_ids = np.unique(_token_ids(keywords))
+    keyword_recall = np.isin(keyword_ids, answer_ids, assume_unique=True).mean() if keyword_ids.size else token_overlap
+
+    answer_vector = _ngram_vector(user_answer or "")
+    reference_vector = _ngram_vector(correct_answer or "")
+    norms = np.linalg.norm(answer_vector) * np.linalg.norm(reference_vector)
+    ngram_similarity = float(answer_vector @ reference_vector / norms) if norms else 0.0
+
+    return np.array([token_overlap, keyword_recall, ngram_similarity], dtype=np.float32)
+
+
+def similarity(user_answer, correct_answer, weights=PRESCORER_WEIGHTS):
+    """
+    :return: Weighted combination of the lexical features, in [0, 1]
+    """
+    weights = np.asarray(weights, dtype=np.float32)
+    return float(features(user_answer, correct_answer) @ weights / weights.sum())
+
+
+def prescore(user_answer, correct_answer, low=PRESCORER_LOW, high=PRESCORER_HIGH):
+    """
+    Grades obvious answers locally: blank answers and answers far below the uncertainty
+    band get 0, near-verbatim answers above it get 5
+    :param user_answer: Student answer
+    :param correct_answer: Reference answer
+    :param low: Similarity at or below which the answer is graded 0
+    :param high: Similarity at or above which the answer is graded 5
+    :return: {"score": X} when the grade is certain, None when the LLM should decide
+    """
+    if not PRESCORER_ENABLED:
+        return None
+    with _stats_lock:
+        _stats["total"] += 1
+
+    if not tokenize(user_answer or ""):
+        outcome, evaluation = "blank", {"score": 0}
+    else:
+        value = similarity(user_answer, correct_answer)
+        if value <= low:
+            outcome, evaluation = "low", {"score": 0}
+        elif value >= high:
+            outcome, evaluation = "high", {"score": 5}
+        else:
+            return None
+
+    with _stats_lock:
+        _stats["short_circuited"] += 1
+        _stats[outcome] += 1
+    return evaluation
+
+
+def get_prescorer_stats():
+    """
+    Returns how many evaluations were graded locally instead of by the LLM
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["short_circuit_rate"] = stats["short_circuited"] / stats["total"] if stats["total"] else 0.0
+    stats["band"] = [PRESCORER_LOW, PRESCORER_HIGH]
+    return stats
@@ -0,0 +1,115 @@
+from utils import stats_views
+from utils.stats_aggregates import parse_score
+from utils.text_utils import question_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS question_stats (
+    question_id TEXT PRIMARY KEY,
+    note_title TEXT NOT NULL,
+    question TEXT NOT NULL,
+    correct_answer TEXT,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_question_stats_note_mean ON question_stats(note_title, mean);
+"""
+
+HARDEST, EASIEST = "hardest", "easiest"
+_FIELDS = "question_id, note_title, question, correct_answer, count, mean, m2"
+
+
+def apply_attempts(conn, note_title, attempts):
+    """
+    Folds the scores of attempts saved after the note's view position into the running count, mean
+    and sum of squared deviations of their questions (Welford's algorithm), reading and writing each
+    question once
+    :param conn: Connection of the stats views, inside their transaction
+    :param note_title: Note title
+    :param attempts: Saved attempts, in storage order
+    """
+    questions = {}
+    for attempt in attempts:
+        score = parse_score(attempt.get("score"))
+        if score is None or not attempt.get("question"):
+            continue
+        question_id = question_hash(note_title, attempt["question"])
+        if question_id not in questions:
+            row = conn.execute("SELECT count, mean, m2 FROM question_stats WHERE question_id = ?", (question_id,)).fetchone()
+            questions[question_id] = [*(row or (0, 0.0, 0.0)), attempt["question"], attempt.get("correct_answer")]
+        stats = questions[question_id]
+        stats[0] += 1
+        delta = score - stats[1]
+        stats[1] += delta / stats[0]
+        stats[2] += delta * (score - stats[1])
+        stats[3], stats[4] = attempt["question"], attempt.get("correct_answer")
+    conn.executemany(
+        "INSERT OR REPLACE INTO question_stats (question_id, note_title, question, correct_answer, count, mean, m2) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(question_id, note_title, question, correct_answer, count, mean, m2)
+         for question_id, (count, mean, m2, question, correct_answer) in questions.items()],
+    )
+
+
+def drop_note(conn, note_title):
+    conn.execute("DELETE FROM question_stats WHERE note_title = ?", (note_title,))
+
+
+def drop_all(conn):
+    conn.execute("DELETE FROM question_stats")
+
+
+def _to_dict(row):
+    question_id, note_title, question, correct_answer, count, mean, m2 = row
+    return {
+        "question_id": question_id,
+        "note_title": note_title,
+        "question": question,
+        "correct_answer": correct_answer,
+        "count": count,
+        "mean": round(mean, 3),
+        # Sample variance, 0 until a question is answered twice
+        "variance": round(m2 / (count - 1), 3) if count > 1 else 0.0,
+    }
+
+
+def get_question_difficulty(note_title, order=HARDEST, limit=10, min_attempts=1):
+    """
+    Ranks the questions of a note by mean score, walking the (note, mean) index from either end
+    :param note_title: Note title
+    :param order: HARDEST (lowest mean first) or EASIEST
+    :param limit: Maximum number of questions
+    :param min_attempts: Skip the questions answered fewer times than this
+    :return: List of questions (question_id, note_title, question, correct_answer, count, mean, variance)
+    """
+    if order not in (HARDEST, EASIEST):
+        raise ValueError(f"Unknown order: {order}")
+    rows = stats_views.connection().execute(
+        f"SELECT {_FIELDS} FROM question_stats WHERE note_title = ? AND count >= ? "
+        f"ORDER BY mean {'ASC' if order == HARDEST else 'DESC'} LIMIT ?",
+        (note_title, min_attempts, limit),
+    )
+    return [_to_dict(row) for row in rows]
+
+
+def sample_questions(note_title, size=10, min_mean=None, max_mean=None):
+    """
+    Draws questions of a note at random within a band of mean scores, e.g. max_mean=2.5 for a quiz
+    of hard questions. Only the index range of the band is read.
+    :param note_title: Note title
+    :param size: Number of questions
+    :param min_mean: Lowest mean score, None for no bound
+    :param max_mean: Highest mean score, None for no bound
+    :return: List of questions ({text, reponse, note_title, stats}) in random order
+    """
+    query, params = f"SELECT {_FIELDS} FROM question_stats WHERE note_title = ?", [note_title]
+    if min_mean is not None:
+        query += " AND mean >= ?"
+        params.append(min_mean)
+    if max_mean is not None:
+        query += " AND mean <= ?"
+        params.append(max_mean)
+    rows = stats_views.connection().execute(query + " ORDER BY random() LIMIT ?", params + [size])
+    return [{"text": stats["question"], "reponse": stats["correct_answer"], "note_title": note_title, "stats": stats}
+            for stats in map(_to_dict, rows)]
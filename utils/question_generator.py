@@ -1,103 +1,512 @@
 import os
 import re
 import json
+import time
+import asyncio
 import logging
-from openai import OpenAI
-from dotenv import load_dotenv
-from config import QUESTIONS_DIR, QUESTIONS_FILE
+import threading
+from collections import Counter, defaultdict
+from config import (QUESTIONS_DIR, QUESTIONS_FILE, LLM_MODEL, GENERATION_PROMPT_VERSION,
+                    GENERATION_CACHE_PATH, GENERATION_CACHE_MAX_ENTRIES, GENERATION_CACHE_MAX_BYTES,
+                    GENERATION_CHUNK_TOKENS, GENERATION_CHUNK_CONCURRENCY,
+                    EVALUATION_CACHE_PATH, EVALUATION_CACHE_MAX_ENTRIES, EVALUATION_CACHE_TTL,
+                    EVALUATION_CACHE_MEMORY_ENTRIES, EVALUATION_BATCH_MAX_CHARS, EVALUATION_BATCH_MAX_ITEMS)
+from storage import get_storage
+from utils.llm_cache import LLMCache, make_key
+from utils.single_flight import SingleFlight
+from utils.llm_client import chat_completion, stream_chat_completion, INTERACTIVE, BULK
+from utils.chunking import split_sections, split_paragraphs, estimate_tokens
+from utils.llm_scheduler import LLMUnavailableError
+from utils.json_stream import JSONArrayStream
+from utils.text_utils import normalize_answer, tokenize
+from utils.note_manager import get_note
+from utils.prescorer import prescore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-# Load environment variables
-load_dotenv()
+generation_cache = LLMCache(
+    GENERATION_CACHE_PATH,
+    max_entries=GENERATION_CACHE_MAX_ENTRIES,
+    max_bytes=GENERATION_CACHE_MAX_BYTES,
+    version=GENERATION_PROMPT_VERSION,
+)
+
+# Concurrent generations of the same note and content are coalesced into one
+generation_flights = SingleFlight()
+
+
+class EvaluationError(Exception):
+    """
+    The model answered but its grade could not be used; unlike a score of 0 it must never be saved
+    """
 
-# API configuration
-# api_key = os.getenv("DEEPSEEK_KEY")
-api_key = "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" 
+GENERATION_PROMPT = (
+    "From this text, create relatively open-ended questions that allow for active learning.\n"
+    "Choose the right number of questions for the length of the text.\n"
+    "For each question, return a JSON with two keys: "
+    "text' for the question and 'reponse' for the correct answer.\n"
+    "Text : {note_content}\n"
+    "Returns JSON only, nothing else."
+)
 
-if not api_key:
-    raise ValueError("DEEPSEEK_KEY environment variable is not set!")
+EVALUATION_PROMPT = (
+    "You're a teacher who evaluates a student's response in a caring way.\n"
+    "Question: {question}\n"
+    "Correct answer: {correct_answer}\n"
+    "Student response: {user_answer}\n\n"
+    "Valuation rules:\n"
+    "- A short answer that contains the essential elements deserves a very good mark.\n"
+    "- If the main keywords are present, the score should be high (4 or 5).\n"
+    "- The form of the answer is less important than the content\n"
+    "- A concise, precise answer is worth as much as a detailed one\n\n"
+    "Returns ONLY a valid JSON with this exact format: {{\"score\": X}} where X is a number between 0 and 5.\n"
+    "Use double quotes for the key \"score\"."
+)
+# Derived from the prompt itself so that any change to it invalidates cached grades
+EVALUATION_PROMPT_VERSION = make_key(LLM_MODEL, EVALUATION_PROMPT)[:16]
+
+BATCH_EVALUATION_PROMPT = (
+    "You're a teacher who evaluates students' responses in a caring way.\n"
+    "Grade each of the following {count} answers independently.\n\n"
+    "{items}\n\n"
+    "Valuation rules:\n"
+    "- A short answer that contains the essential elements deserves a very good mark.\n"
+    "- If the main keywords are present, the score should be high (4 or 5).\n"
+    "- The form of the answer is less important than the content\n"
+    "- A concise, precise answer is worth as much as a detailed one\n\n"
+    "Returns ONLY a valid JSON with this exact format: {{\"scores\": [X1, X2, ...]}} "
+    "with exactly {count} numbers between 0 and 5, in the order of the answers above."
+)
+BATCH_EVALUATION_ITEM = (
+    "### Answer {index}\n"
+    "Question: {question}\n"
+    "Correct answer: {correct_answer}\n"
+    "Student response: {user_answer}"
+)
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=api_key,
+evaluation_cache = LLMCache(
+    EVALUATION_CACHE_PATH,
+    max_entries=EVALUATION_CACHE_MAX_ENTRIES,
+    ttl=EVALUATION_CACHE_TTL,
+    memory_entries=EVALUATION_CACHE_MEMORY_ENTRIES,
+    version=EVALUATION_PROMPT_VERSION,
 )
 
 def load_question(title):
-    json_file_path = os.path.join(QUESTIONS_DIR, f"{title}.json")
-    if os.path.exists(json_file_path):
-        with open(json_file_path, "r") as file:
-            questions = json.load(file)
-    else:
-        questions = []
-    return questions
+    return get_storage().read_questions(title)
 
 def update_questions(new_questions, title):
-    json_file_path = os.path.join(QUESTIONS_DIR, f"{title}.json")
-    if os.path.exists(json_file_path):
-        with open(json_file_path, "w") as file:
-            json.dump(new_questions, file, indent=4, ensure_ascii=False)
+    storage = get_storage()
+    if storage.questions_exist(title):
+        storage.write_questions(title, new_questions)
 
 
 def delete_all_questions(title):
-    json_file_path = os.path.join(QUESTIONS_DIR, f"{title}.json")
-    with open(json_file_path, "w") as file:
-        json.dump("details", file, indent=4, ensure_ascii=False)
+    get_storage().delete_questions(title)
+
+
+def _parse_questions(generated_text):
+    """
+    Parses the questions returned by the model, stripping a ```json fence if present
+    """
+    generated_text = (generated_text or "").strip()
+    if generated_text.startswith("```json") and generated_text.endswith("```"):
+        generated_text = generated_text.strip("```json").strip("```")
+    if not generated_text:
+        raise ValueError("Empty response returned by the API.")
+
+    # Loading JSON
+    try:
+        return json.loads(generated_text)
+    except json.JSONDecodeError as json_err:
+        logging.error("Error parsing JSON : %s", json_err)
+        raise ValueError("The API response is not a valid JSON.")
 
 
-def generate_questions(note_title, note_content):
+def generation_cache_key(note_content):
+    return make_key(LLM_MODEL, GENERATION_PROMPT_VERSION, note_content)
+
+
+def generate_questions(note_title, note_content, force=False):
+    """
+    Synchronous wrapper around agenerate_questions for scripts and the standalone Streamlit app
+    """
+    return asyncio.run(agenerate_questions(note_title, note_content, force=force))
+
+
+def generation_flight_key(note_title, note_content, force=False):
+    """
+    Identifies a generation: concurrent requests for the same note and content share one.
+    Forced requests only share with each other, a non-forced one may be served from the cache.
+    """
+    return make_key(note_title, note_content) + (":force" if force else "")
+
+
+async def agenerate_questions(note_title, note_content, force=False, priority=BULK):
+    """
+    Generates questions from note content, joining the generation already in flight
+    for the same note and content if there is one (see _agenerate_questions)
+    """
+    return await generation_flights.do(
+        generation_flight_key(note_title, note_content, force),
+        lambda: _agenerate_questions(note_title, note_content, force=force, priority=priority),
+    )
+
+
+async def _agenerate_questions(note_title, note_content, force=False, priority=BULK):
     """
     Generates questions from note content using the DeepSeek API.
+    Notes longer than GENERATION_CHUNK_TOKENS are split into sections whose questions are
+    generated concurrently then merged. Questions already generated for the same content,
+    model and prompt version are served from the generation cache unless force is set.
     :param note_title: Note title
     :param note_content: Note content
-    :return: A list of generated questions
+    :param force: Bypass the cache and call the model
+    :param priority: Scheduler lane of the model calls, bulk by default
+    :return: A list of generated questions, empty if the response could not be used
+    :raises LLMUnavailableError: The model could not be reached before the deadline
     """
     try:
-        prompt = (
-            f"From this text, create relatively open-ended questions that allow for active learning.\n"
-            f"Choose the right number of questions for the length of the text.\n"
-            f"For each question, return a JSON with two keys: "
-            f"text' for the question and 'reponse' for the correct answer.\n"
-            f"Text : {note_content}\n"
-            f"Returns JSON only, nothing else."
-        )
+        cache_key = generation_cache_key(note_content)
+        questions = None if force else generation_cache.get(cache_key)
+        if questions is not None:
+            logging.info("Questions for %s served from the generation cache", note_title)
+        else:
+            sections = _split_note(note_content)
+            started = time.perf_counter()
+            if len(sections) > 1:
+                logging.info("Generating questions for %s in %d sections", note_title, len(sections))
+                semaphore = asyncio.Semaphore(GENERATION_CHUNK_CONCURRENCY)
+                groups = await asyncio.gather(*(
+                    _generate_section(section, semaphore, force, priority) for section in sections
+                ))
+                questions = _merge_questions(groups)
+            else:
+                prompt = GENERATION_PROMPT.format(note_content=note_content)
 
-        # Send request to API
-        response = client.chat.completions.create(
-            extra_body={},
-            model="deepseek/deepseek-chat",
-            messages=[
-                {"role": "user", "content": prompt},
-            ],
-        )
+                # Send request to API
+                response = await chat_completion(prompt, priority=priority)
 
-        # Checking the answer
-        logging.info("Raw API response : %s", response)
-        generated_text = response.choices[0].message.content.strip()
-        if generated_text.startswith("```json") and generated_text.endswith("```"):
-            generated_text = generated_text.strip("```json").strip("```")
-        if not generated_text:
-            raise ValueError("Empty response returned by the API.")
+                # Checking the answer
+                logging.info("Raw API response : %s", response)
+                questions = _parse_questions(response.choices[0].message.content)
+            latency = time.perf_counter() - started
 
-        # Loading JSON
-        try:
-            questions = json.loads(generated_text)
-        except json.JSONDecodeError as json_err:
-            logging.error("Error parsing JSON : %s", json_err)
-            raise ValueError("The API response is not a valid JSON.")
-
-        # Save questions in a JSON file
-        json_file_path = os.path.join(QUESTIONS_DIR, f"{note_title}.json")
-        with open(json_file_path, "w") as file:
-            json.dump(questions, file, indent=4, ensure_ascii=False)
-        logging.info("Questions saved in : %s", json_file_path)
+            questions = list(map(_section_tagger(note_content), questions))
+            if questions:
+                generation_cache.put(cache_key, questions, latency)
+        questions = _tag_questions(questions, note_content)
+
+        # Save questions for the note
+        get_storage().write_questions(note_title, questions)
+        logging.info("Questions saved for : %s", note_title)
         return questions
 
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         logging.error("Error when generating questions : %s", e)
         return []
 
+
+def _split_note(note_content):
+    """
+    :return: The sections of a note too long for a single prompt, or [note_content] if it fits in one
+    """
+    if estimate_tokens(note_content) <= GENERATION_CHUNK_TOKENS:
+        return [note_content]
+    return split_sections(note_content, GENERATION_CHUNK_TOKENS)
+
+
+async def _generate_section(section, semaphore, force=False, priority=BULK):
+    """
+    Generates the questions of one section of a long note, through the generation cache
+    :param semaphore: Bounds the number of sections of the note generated at the same time
+    :return: List of questions, empty if the response could not be used
+    :raises LLMUnavailableError: The model could not be reached before the deadline
+    """
+    cache_key = generation_cache_key(section)
+    questions = None if force else generation_cache.get(cache_key)
+    if questions is not None:
+        return questions
+    async with semaphore:
+        started = time.perf_counter()
+        response = await chat_completion(GENERATION_PROMPT.format(note_content=section), priority=priority)
+        latency = time.perf_counter() - started
+    try:
+        questions = _parse_questions(response.choices[0].message.content)
+    except ValueError as e:
+        logging.error("Error when generating questions for a section : %s", e)
+        return []
+    if isinstance(questions, dict):
+        questions = [questions]
+    # An empty answer is not cached, the next generation asks the model again
+    if questions:
+        generation_cache.put(cache_key, questions, latency)
+    return questions
+
+
+def _merge_questions(groups, seen=None):
+    """
+    Concatenates the questions of several sections, dropping those whose normalized
+    text or answer was already asked
+    :param groups: Lists of questions, in note order
+    :param seen: Set of already asked keys, updated in place
+    :return: Merged list of questions
+    """
+    seen = set() if seen is None else seen
+    merged = []
+    for questions in groups:
+        for question in questions:
+            keys = {("text", normalize_answer(question.get("text"))), ("reponse", normalize_answer(question.get("reponse")))}
+            if keys & seen:
+                continue
+            seen.update(keys)
+            merged.append(question)
+    return merged
+
+
+def section_hash(paragraph):
+    """
+    Identifies a paragraph of a note regardless of its case and whitespace
+    """
+    return make_key(normalize_answer(paragraph))[:16]
+
+
+def _section_tagger(note_content, paragraphs=None):
+    """
+    :param note_content: Content the questions were generated from
+    :param paragraphs: Paragraph texts to choose from, all the paragraphs of the note by default
+    :return: Function returning a copy of a question with the "section" hash of the paragraph it
+             most likely comes from, i.e. the one sharing the most (and rarest) words with its answer
+    """
+    if paragraphs is None:
+        paragraphs = [paragraph for _, paragraph in split_paragraphs(note_content)] or [note_content]
+    hashes = [section_hash(paragraph) for paragraph in paragraphs]
+    postings = defaultdict(list)
+    for index, paragraph in enumerate(paragraphs):
+        for token in set(tokenize(paragraph)):
+            postings[token].append(index)
+
+    def tag(question):
+        scores = Counter()
+        for weight, field in ((2.0, "reponse"), (1.0, "text")):
+            for token in set(tokenize(str(question.get(field) or ""))):
+                indexes = postings.get(token, ())
+                for index in indexes:
+                    scores[index] += weight / len(indexes)
+        best = max(scores, key=lambda index: (scores[index], -index)) if scores else 0
+        return {**question, "section": hashes[best]}
+
+    return tag
+
+
+def _tag_questions(questions, note_content):
+    """
+    Tags the questions that do not have a section yet, e.g. those cached before sections were tracked
+    """
+    if all("section" in question for question in questions):
+        return questions
+    return list(map(_section_tagger(note_content), questions))
+
+
+_regeneration_locks = defaultdict(threading.Lock)
+
+
+def regenerate_changed_questions(note_title, old_content=None):
+    """
+    Synchronous wrapper around aregenerate_changed_questions, serialized per note
+    """
+    with _regeneration_locks[note_title]:
+        return asyncio.run(aregenerate_changed_questions(note_title, old_content))
+
+
+async def aregenerate_changed_questions(note_title, old_content=None, priority=BULK):
+    """
+    Refreshes the questions of a note after an edit. Questions of unchanged paragraphs are kept,
+    those of removed paragraphs are dropped and questions are only generated for paragraphs that
+    are new or were modified since old_content. The question file is written once, atomically,
+    and only if the note did not change again in the meantime (the diff is redone otherwise).
+    :param note_title: Note title
+    :param old_content: Content before the edit, also used to tag questions saved without a section
+    :param priority: Scheduler lane of the model calls, bulk by default
+    :return: {"kept", "generated", "dropped"} counts, or None if the note has no questions to refresh
+    :raises LLMUnavailableError: The model could not be reached before the deadline
+    """
+    storage = get_storage()
+    questions = storage.read_questions(note_title)
+    note = get_note(note_title)
+    if not questions or note is None:
+        return None
+
+    base = old_content if old_content is not None else note["content"]
+    counts = {"kept": 0, "generated": 0, "dropped": 0}
+    started = time.perf_counter()
+    while True:
+        questions, step = await _refresh_questions(questions, base, note["content"], priority)
+        counts = {"kept": step["kept"], "generated": counts["generated"] + step["generated"],
+                  "dropped": counts["dropped"] + step["dropped"]}
+        latest = get_note(note_title)
+        if latest is None:
+            return None
+        if latest["hash"] == note["hash"]:
+            break
+        logging.info("%s changed during question regeneration, diffing again", note_title)
+        base, note = note["content"], latest
+
+    storage.write_questions(note_title, questions)
+    generation_cache.put(generation_cache_key(note["content"]), questions, time.perf_counter() - started)
+    logging.info("Questions of %s refreshed : %s", note_title, counts)
+    return counts
+
+
+async def _refresh_questions(questions, old_content, new_content, priority=BULK):
+    """
+    :return: (questions for new_content, {"kept", "generated", "dropped"} counts)
+    """
+    if any("section" not in question for question in questions):
+        legacy_tag = _section_tagger(old_content)
+        questions = [question if "section" in question else legacy_tag(question) for question in questions]
+
+    by_section = defaultdict(list)
+    for question in questions:
+        by_section[question["section"]].append(question)
+    old_sections = {section_hash(paragraph) for _, paragraph in split_paragraphs(old_content)}
+
+    # Consecutive new or modified paragraphs under the same heading are generated together
+    units = []
+    for heading, paragraph in split_paragraphs(new_content):
+        section = section_hash(paragraph)
+        if section in by_section or section in old_sections:
+            units.append(("keep", section))
+            continue
+        previous = units[-1] if units else None
+        if (previous and previous[0] == "generate" and previous[1] == heading
+                and estimate_tokens("\n\n".join(previous[2] + [paragraph])) <= GENERATION_CHUNK_TOKENS):
+            previous[2].append(paragraph)
+        else:
+            units.append(("generate", heading, [paragraph]))
+
+    semaphore = asyncio.Semaphore(GENERATION_CHUNK_CONCURRENCY)
+
+    async def generate(heading, paragraphs):
+        text = "\n\n".join(([heading] if heading else []) + paragraphs)
+        generated = await _generate_section(text, semaphore, priority=priority)
+        return list(map(_section_tagger(text, paragraphs), generated))
+
+    runs = [unit for unit in units if unit[0] == "generate"]
+    generated = iter(await asyncio.gather(*(generate(heading, paragraphs) for _, heading, paragraphs in runs)))
+
+    groups, kept_sections = [], set()
+    for unit in units:
+        if unit[0] == "generate":
+            groups.append(next(generated))
+        elif unit[1] not in kept_sections:
+            kept_sections.add(unit[1])
+            groups.append(by_section.get(unit[1], []))
+    refreshed = _merge_questions(groups)
+
+    kept = sum(1 for question in refreshed if question["section"] in kept_sections)
+    counts = {"kept": kept, "generated": len(refreshed) - kept, "dropped": len(questions) - kept}
+    return refreshed, counts
+
+
+def run_regeneration_job(payload):
+    """
+    Job queue handler refreshing the questions of an edited note
+    :param payload: {"note_title", "old_content"}
+    :return: {"kept", "generated", "dropped"} counts, or None if the note has no questions
+    """
+    return regenerate_changed_questions(payload["note_title"], payload.get("old_content"))
+
+
+async def astream_questions(note_title, note_content, force=False):
+    """
+    Streams the questions of a note, joining the generation already in flight for the
+    same note and content if there is one (see _astream_questions)
+    """
+    async for question in generation_flights.stream(
+        generation_flight_key(note_title, note_content, force),
+        lambda: _astream_questions(note_title, note_content, force=force),
+    ):
+        yield question
+
+
+async def _astream_questions(note_title, note_content, force=False):
+    """
+    Generates questions like agenerate_questions but yields each question as soon as the
+    model has finished writing it, or for long notes as soon as its section is done.
+    The full set is cached and saved once the stream ends.
+    :param note_title: Note title
+    :param note_content: Note content
+    :param force: Bypass the cache and call the model
+    :return: Async generator of {"text", "reponse"} dictionaries
+    """
+    cache_key = generation_cache_key(note_content)
+    questions = None if force else generation_cache.get(cache_key)
+    sections = _split_note(note_content) if questions is None else []
+    if questions is not None:
+        logging.info("Questions for %s served from the generation cache", note_title)
+        questions = _tag_questions(questions, note_content)
+        for question in questions:
+            yield question
+    elif len(sections) > 1:
+        tag = _section_tagger(note_content)
+        semaphore = asyncio.Semaphore(GENERATION_CHUNK_CONCURRENCY)
+        tasks = [asyncio.ensure_future(_generate_section(section, semaphore, force, INTERACTIVE)) for section in sections]
+        questions, seen = [], set()
+        started = time.perf_counter()
+        try:
+            for task in asyncio.as_completed(tasks):
+                for question in _merge_questions([await task], seen):
+                    questions.append(tag(question))
+                    yield questions[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+        if questions:
+            generation_cache.put(cache_key, questions, time.perf_counter() - started)
+    else:
+        tag = _section_tagger(note_content)
+        prompt = GENERATION_PROMPT.format(note_content=note_content)
+        parser = JSONArrayStream()
+        generated_text = ""
+        questions = []
+        started = time.perf_counter()
+        async for chunk in stream_chat_completion(prompt):
+            generated_text += chunk
+            for question in parser.feed(chunk):
+                questions.append(tag(question))
+                yield questions[-1]
+        latency = time.perf_counter() - started
+
+        if not questions:
+            # The model did not answer with an array: fall back to parsing the whole text
+            questions = _parse_questions(generated_text)
+            if isinstance(questions, dict):
+                questions = [questions]
+            questions = list(map(tag, questions))
+            for question in questions:
+                yield question
+        if questions:
+            generation_cache.put(cache_key, questions, latency)
+
+    get_storage().write_questions(note_title, questions)
+    logging.info("Questions saved for : %s", note_title)
+
+
+def run_generation_job(payload):
+    """
+    Job queue handler generating the questions of a note
+    :param payload: {"note_title", "note_content", "force"}
+    :return: The generated questions
+    """
+    questions = generate_questions(payload["note_title"], payload["note_content"], force=payload.get("force", False))
+    if not questions:
+        raise RuntimeError("No questions could be generated for this note")
+    return questions
+
 def save_questions(questions):
     """
     Saves generated questions in a JSON file.
@@ -125,30 +534,57 @@ def load_questions():
         logging.error("Error loading questions : %s", e)
     return []
 
+def evaluation_cache_key(question, user_answer, correct_answer):
+    return make_key(
+        EVALUATION_PROMPT_VERSION,
+        normalize_answer(question),
+        normalize_answer(user_answer),
+        normalize_answer(correct_answer),
+    )
+
+
 def evaluate_answer(question, user_answer, correct_answer):
+    """
+    Synchronous wrapper around aevaluate_answer
+    """
+    return asyncio.run(aevaluate_answer(question, user_answer, correct_answer))
+
+
+async def aevaluate_answer(question, user_answer, correct_answer):
+    """
+    Evaluates user response, reusing the grade of an identical (normalized) submission if one is cached
+    and grading obvious answers with the local pre-scorer before calling the API
+    :raises LLMUnavailableError: The model could not be reached before the deadline
+    :raises EvaluationError: The model's response held no usable score
+    """
+    cache_key = evaluation_cache_key(question, user_answer, correct_answer)
+    cached = evaluation_cache.get(cache_key)
+    if cached is not None:
+        return {"score": cached["score"]}
+
+    evaluation = prescore(user_answer, correct_answer)
+    if evaluation is not None:
+        return evaluation
+
+    started = time.perf_counter()
+    evaluation = await _request_evaluation(question, user_answer, correct_answer)
+    if evaluation is not None:
+        evaluation_cache.put(cache_key, evaluation, time.perf_counter() - started)
+        return evaluation
+    raise EvaluationError("The answer could not be assessed, the model's response held no usable score")
+
+
+async def _request_evaluation(question, user_answer, correct_answer):
     """
     Evaluates user response using the API
+    :return: {"score": X}, or None if the response could not be parsed
     """
     try:
-        prompt = (
-            f"You're a teacher who evaluates a student's response in a caring way.\n"
-            f"Question: {question}\n"
-            f"Correct answer: {correct_answer}\n"
-            f"Student response: {user_answer}\n\n"
-            f"Valuation rules:\n"
-            f"- A short answer that contains the essential elements deserves a very good mark.\n"
-            f"- If the main keywords are present, the score should be high (4 or 5).\n"
-            f"- The form of the answer is less important than the content\n"
-            f"- A concise, precise answer is worth as much as a detailed one\n\n"
-            f"Returns ONLY a valid JSON with this exact format: {{\"score\": X}} where X is a number between 0 and 5.\n"
-            f"Use double quotes for the key \"score\"."
+        prompt = EVALUATION_PROMPT.format(
+            question=question, correct_answer=correct_answer, user_answer=user_answer
         )
 
-        response = client.chat.completions.create(
-            extra_body={},
-            model="deepseek/deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-        )
+        response = await chat_completion(prompt)
 
         if not response or not response.choices:
             raise ValueError("The API did not return any valid choices.")
@@ -168,15 +604,127 @@ def evaluate_answer(question, user_answer, correct_answer):
         except json.JSONDecodeError:
             # If parsing fails, attempt to correct format
             score_match = re.search(r'score["\']?\s*:\s*(\d+)', cleaned_content)
-            if score_match:
-                return {"score": int(score_match.group(1))}
-            raise
+            if not score_match:
+                raise
+            evaluation = {"score": int(score_match.group(1))}
 
         if "score" not in evaluation:
             raise ValueError("The JSON returned does not contain the key 'score'.")
+        # Same check as the batch grading: anything else would be saved as a real grade
+        score = evaluation["score"]
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 5:
+            raise ValueError(f"Score out of range: {score!r}")
 
-        return {"score": evaluation["score"]}
+        return {"score": score}
 
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         logging.exception("Error in response evaluation")
-        return {"score": 0}
\ No newline at end of file
+        return None
+
+
+def _chunk_evaluations(items):
+    """
+    Splits (key, item) pairs into batches that fit EVALUATION_BATCH_MAX_CHARS and EVALUATION_BATCH_MAX_ITEMS
+    """
+    batches, batch, batch_chars = [], [], 0
+    for key, item in items:
+        item_chars = len(item["question"]) + len(item["user_answer"]) + len(item["correct_answer"]) + 64
+        if batch and (batch_chars + item_chars > EVALUATION_BATCH_MAX_CHARS or len(batch) >= EVALUATION_BATCH_MAX_ITEMS):
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append((key, item))
+        batch_chars += item_chars
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+async def _request_batch_evaluation(items):
+    """
+    Grades several answers with a single API call
+    :param items: List of {"question", "user_answer", "correct_answer"} dictionaries
+    :return: List of {"score": X} aligned with items, or None if the response is unusable
+    :raises LLMUnavailableError: The model could not be reached before the deadline
+    """
+    try:
+        prompt = BATCH_EVALUATION_PROMPT.format(
+            count=len(items),
+            items="\n\n".join(
+                BATCH_EVALUATION_ITEM.format(index=index, **item) for index, item in enumerate(items, 1)
+            ),
+        )
+
+        response = await chat_completion(prompt)
+
+        if not response or not response.choices or not response.choices[0].message.content:
+            raise ValueError("The API response is empty.")
+
+        cleaned_content = re.sub(r"^```json\s*|\s*```$", "", response.choices[0].message.content.strip(), flags=re.MULTILINE)
+        scores = json.loads(cleaned_content)["scores"]
+
+        if not isinstance(scores, list) or len(scores) != len(items):
+            raise ValueError(f"Expected {len(items)} scores, got {scores!r}")
+        if not all(isinstance(score, (int, float)) and 0 <= score <= 5 for score in scores):
+            raise ValueError(f"Scores out of range: {scores!r}")
+
+        return [{"score": score} for score in scores]
+
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        logging.error("Error in batch evaluation of %d answers : %s", len(items), e)
+        return None
+
+
+def evaluate_answers(items):
+    """
+    Synchronous wrapper around aevaluate_answers
+    """
+    return asyncio.run(aevaluate_answers(items))
+
+
+async def _evaluate_batch(batch, evaluations):
+    started = time.perf_counter()
+    results = await _request_batch_evaluation([item for _, item in batch])
+    if results is None:
+        fallback = await asyncio.gather(*(
+            aevaluate_answer(item["question"], item["user_answer"], item["correct_answer"]) for _, item in batch
+        ))
+        for (key, _), evaluation in zip(batch, fallback):
+            evaluations[key] = evaluation
+        return
+    latency = (time.perf_counter() - started) / len(batch)
+    for (key, _), evaluation in zip(batch, results):
+        evaluation_cache.put(key, evaluation, latency)
+        evaluations[key] = evaluation
+
+
+async def aevaluate_answers(items):
+    """
+    Evaluates a whole quiz, grading every uncached answer in as few API calls as possible
+    Batches are sent concurrently; those whose response does not match the input are
+    re-graded one answer at a time.
+    :param items: List of {"question", "user_answer", "correct_answer"} dictionaries
+    :return: List of {"score": X} aligned with items
+    :raises LLMUnavailableError: The model could not be reached before the deadline
+    :raises EvaluationError: An answer could not be graded, even on its own
+    """
+    keys = [evaluation_cache_key(item["question"], item["user_answer"], item["correct_answer"]) for item in items]
+    evaluations = {}
+    pending = {}
+    for key, item in zip(keys, items):
+        if key in evaluations or key in pending:
+            continue
+        cached = evaluation_cache.get(key)
+        if cached is None:
+            cached = prescore(item["user_answer"], item["correct_answer"])
+        if cached is not None:
+            evaluations[key] = {"score": cached["score"]}
+        else:
+            pending[key] = item
+
+    await asyncio.gather(*(_evaluate_batch(batch, evaluations) for batch in _chunk_evaluations(pending.items())))
+
+    return [dict(evaluations[key]) for key in keys]
@@ -0,0 +1,239 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+from config import SEARCH_INDEX_PATH
+from storage import get_storage
+from storage.sqlite import ThreadLocalConnections
+from utils.text_utils import tokenize, iter_token_spans
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_RADIUS = 80
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL UNIQUE,
+    length INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    mtime INTEGER,
+    size INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id);
+
+CREATE TABLE IF NOT EXISTS corpus (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    doc_count INTEGER NOT NULL,
+    total_length INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO corpus (id, doc_count, total_length) VALUES (0, 0, 0);
+"""
+
+_db = None
+_db_lock = threading.Lock()
+_sync = {"thread": None, "synced": False}
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                db = ThreadLocalConnections(SEARCH_INDEX_PATH, SCHEMA)
+                _upgrade_schema(db)
+                _db = db
+    return _db
+
+
+def _upgrade_schema(db):
+    columns = [row[1] for row in db.get().execute("PRAGMA table_info(docs)")]
+    # Indexes built before the note versions were stored: their notes are hashed once by the next sync
+    if "mtime" not in columns:
+        db.get().execute("ALTER TABLE docs ADD COLUMN mtime INTEGER")
+        db.get().execute("ALTER TABLE docs ADD COLUMN size INTEGER")
+
+
+def _document_text(title, content):
+    return f"{title}\n{content}"
+
+
+def _remove_doc(conn, title):
+    row = conn.execute("SELECT doc_id, length FROM docs WHERE title = ?", (title,)).fetchone()
+    if row is None:
+        return
+    doc_id, length = row
+    conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+    conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+    conn.execute(
+        "UPDATE corpus SET doc_count = doc_count - 1, total_length = total_length - ? WHERE id = 0",
+        (length,),
+    )
+
+
+def index_note(title, content, version=None):
+    """
+    Adds or replaces a note in the index, touching only that note's postings
+    :param title: Note title
+    :param content: Note content
+    :param version: (mtime_ns, size) of the note in the storage, compared by the next sync
+    :return: False if a newer version of the note was indexed meanwhile and content was left out
+    """
+    mtime, size = version if version is not None else (None, None)
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    tokens = tokenize(_document_text(title, content))
+    term_counts = Counter(tokens)
+    with _get_db().transaction() as conn:
+        row = conn.execute("SELECT hash, mtime FROM docs WHERE title = ?", (title,)).fetchone()
+        if row and mtime is not None and row[1] is not None and row[1] > mtime:
+            # Read by a sync before a save indexed the newer content
+            return False
+        if row and row[0] == content_hash:
+            conn.execute("UPDATE docs SET mtime = ?, size = ? WHERE title = ?", (mtime, size, title))
+            return True
+        _remove_doc(conn, title)
+        cursor = conn.execute(
+            "INSERT INTO docs (title, length, hash, mtime, size) VALUES (?, ?, ?, ?, ?)",
+            (title, len(tokens), content_hash, mtime, size),
+        )
+        doc_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+            [(term, doc_id, tf) for term, tf in term_counts.items()],
+        )
+        conn.execute(
+            "UPDATE corpus SET doc_count = doc_count + 1, total_length = total_length + ? WHERE id = 0",
+            (len(tokens),),
+        )
+    return True
+
+
+def remove_note(title):
+    """
+    Removes a note from the index
+    :param title: Note title
+    """
+    with _get_db().transaction() as conn:
+        _remove_doc(conn, title)
+
+
+def sync_index():
+    """
+    Brings the index in line with the storage, re-indexing only notes whose (mtime, size) differs
+    from the version indexed and dropping notes that no longer exist. Picks up edits made outside the API.
+    A note saved through the API while the sync runs keeps the newer version its save indexed.
+    :return: Dictionary with the number of indexed and removed notes
+    """
+    storage = get_storage()
+    versions = storage.stat_notes()
+    indexed = {title: (mtime, size) for title, mtime, size in _get_db().get().execute("SELECT title, mtime, size FROM docs")}
+    counts = {"indexed": 0, "removed": 0}
+    for title in set(indexed) - set(versions):
+        remove_note(title)
+        counts["removed"] += 1
+    for title, version in versions.items():
+        if indexed.get(title) == tuple(version):
+            continue
+        content = storage.read_note(title)
+        if content is not None and index_note(title, content, tuple(version)):
+            counts["indexed"] += 1
+    return counts
+
+
+def _run_sync():
+    try:
+        counts = sync_index()
+        logging.info("Search index synced: %s", counts)
+        _sync["synced"] = True
+    except Exception as e:
+        logging.error("Error syncing the search index : %s", e)
+
+
+def start_sync():
+    """
+    Syncs the index with the storage in a background thread, once per process, so that no
+    search waits for it. Searches made meanwhile are answered from the index as it is.
+    """
+    if _sync["thread"] is None:
+        _sync["thread"] = threading.Thread(target=_run_sync, name="search-index-sync", daemon=True)
+        _sync["thread"].start()
+
+
+def _snippet(content, terms):
+    """
+    Extracts a window of the original text around the first occurrence of a query term
+    """
+    for token, start, end in iter_token_spans(content):
+        if token in terms:
+            left = max(0, start - SNIPPET_RADIUS)
+            right = min(len(content), end + SNIPPET_RADIUS)
+            snippet = " ".join(content[left:right].split())
+            return ("…" if left > 0 else "") + snippet + ("…" if right < len(content) else "")
+    return " ".join(content[:2 * SNIPPET_RADIUS].split())
+
+
+def _idf(doc_count, df):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def search(query, k=10):
+    """
+    Ranks notes against a query with BM25
+    :param query: Search query, accents and case are ignored
+    :param k: Number of results to return
+    :return: Dictionary with the ranked results (title, score, snippet) and the query time
+    """
+    started = time.perf_counter()
+    terms = list(dict.fromkeys(tokenize(query)))
+    results = []
+    if terms:
+        conn = _get_db().get()
+        doc_count, total_length = conn.execute(
+            "SELECT doc_count, total_length FROM corpus WHERE id = 0"
+        ).fetchone()
+        if doc_count:
+            avg_length = total_length / doc_count
+            weights = []
+            for term in terms:
+                (df,) = conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()
+                if df:
+                    idf = _idf(doc_count, df)
+                    weights.append((term, idf))
+            if weights:
+                values = ", ".join("(?, ?)" for _ in weights)
+                params = [value for pair in weights for value in pair]
+                rows = conn.execute(
+                    f"WITH q(term, idf) AS (VALUES {values}) "
+                    "SELECT d.title, SUM(q.idf * p.tf * (? + 1) / (p.tf + ? * (1 - ? + ? * d.length / ?))) AS score "
+                    "FROM q JOIN postings p ON p.term = q.term JOIN docs d ON d.doc_id = p.doc_id "
+                    "GROUP BY d.doc_id ORDER BY score DESC LIMIT ?",
+                    params + [BM25_K1, BM25_K1, BM25_B, BM25_B, avg_length, k],
+                ).fetchall()
+                storage = get_storage()
+                term_set = set(terms)
+                for title, score in rows:
+                    content = storage.read_note(title) or ""
+                    results.append({"title": title, "score": round(score, 4), "snippet": _snippet(content, term_set)})
+    return {"query": query, "results": results, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+def get_index_stats():
+    """
+    Returns the size of the search index
+    """
+    doc_count, total_length = _get_db().get().execute(
+        "SELECT doc_count, total_length FROM corpus WHERE id = 0"
+    ).fetchone()
+    return {"documents": doc_count, "tokens": total_length, "synced": _sync["synced"]}
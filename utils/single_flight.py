@@ -0,0 +1,138 @@
+import copy
+import asyncio
+import threading
+import concurrent.futures
+
+
+class _Flight:
+    def __init__(self):
+        # Final result, shared by callers from any thread or event loop
+        self.future = concurrent.futures.Future()
+        # Items produced so far by a streamed flight, and the followers waiting for more
+        self.items = []
+        self.waiters = []
+        self.task = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing a key into a single execution whose result every
+    caller receives. Works across threads and event loops (e.g. the uvicorn loop and the
+    job workers' loops). Plain and streamed calls with the same key join each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {"flights": 0, "coalesced": 0}
+
+    def _join(self, key):
+        """
+        :return: (flight, True if the caller must run it)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self._stats["flights"] += 1
+            return flight, True
+
+    def _land(self, key, flight, result=None, error=None):
+        if error is not None and not isinstance(error, Exception):
+            # Followers must not see the leader's cancellation as their own
+            error = RuntimeError("The coalesced call was cancelled")
+        with self._lock:
+            self._flights.pop(key, None)
+            waiters, flight.waiters = flight.waiters, []
+            if error is not None:
+                flight.future.set_exception(error)
+            else:
+                flight.future.set_result(result)
+        for loop, waiter in waiters:
+            self._wake(loop, waiter)
+
+    @staticmethod
+    def _wake(loop, waiter):
+        try:
+            loop.call_soon_threadsafe(lambda: waiter.done() or waiter.set_result(None))
+        except RuntimeError:
+            # The follower's loop is closed
+            pass
+
+    async def do(self, key, function):
+        """
+        Runs function() unless a call with the same key is in flight, in which case its result is awaited
+        :param key: Identity of the call
+        :param function: Coroutine function called without arguments
+        :return: The result of the single execution (a copy for the callers that joined it)
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            return copy.deepcopy(await asyncio.wrap_future(flight.future))
+        try:
+            result = await function()
+        except BaseException as error:
+            self._land(key, flight, error=error)
+            raise
+        self._land(key, flight, result=result)
+        return result
+
+    async def stream(self, key, function):
+        """
+        Streams the items of function() unless a call with the same key is in flight, in which case
+        the items it already produced are replayed then the next ones are yielded as they arrive.
+        The generator runs in a task of its own so that it completes even if the first caller leaves.
+        :param key: Identity of the call
+        :param function: Async generator function called without arguments
+        :return: Async generator of items; the flight's result is the list of all of them
+        """
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(self._pump(key, flight, function))
+
+        loop = asyncio.get_running_loop()
+        position = 0
+        while True:
+            waiter = None
+            with self._lock:
+                items = flight.items[position:]
+                done = flight.future.done()
+                if not items and not done:
+                    waiter = loop.create_future()
+                    flight.waiters.append((loop, waiter))
+            if items:
+                position += len(items)
+                for item in items:
+                    yield copy.deepcopy(item)
+            elif done:
+                result = flight.future.result()
+                # A plain call joined: it only has the final result
+                for item in result[position:] if isinstance(result, list) else ():
+                    yield copy.deepcopy(item)
+                return
+            else:
+                await waiter
+
+    async def _pump(self, key, flight, function):
+        try:
+            async for item in function():
+                with self._lock:
+                    flight.items.append(item)
+                    waiters, flight.waiters = flight.waiters, []
+                for loop, waiter in waiters:
+                    self._wake(loop, waiter)
+        except BaseException as error:
+            self._land(key, flight, error=error)
+            if not isinstance(error, Exception):
+                raise
+            return
+        self._land(key, flight, result=list(flight.items))
+
+    def get_stats(self):
+        """
+        :return: Number of executions, of calls coalesced into one of them and of flights in progress
+        """
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}
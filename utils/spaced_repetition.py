@@ -0,0 +1,133 @@
+import time
+from datetime import datetime
+from storage import get_storage
+from utils import stats_views
+from utils.stats_aggregates import parse_score
+from utils.text_utils import question_hash
+
+# SM-2 parameters
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+PASSING_GRADE = 3
+SECONDS_PER_DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    card_id TEXT PRIMARY KEY,
+    note_title TEXT NOT NULL,
+    question TEXT NOT NULL,
+    correct_answer TEXT,
+    ease REAL NOT NULL,
+    interval REAL NOT NULL,
+    repetitions INTEGER NOT NULL,
+    due REAL NOT NULL,
+    last_review REAL NOT NULL,
+    last_score REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_cards_due ON cards(due);
+CREATE INDEX IF NOT EXISTS idx_cards_note_due ON cards(note_title, due);
+"""
+
+CARD_FIELDS = ("card_id", "note_title", "question", "correct_answer", "ease", "interval", "repetitions", "due",
+               "last_review", "last_score")
+
+def sm2(ease, interval, repetitions, grade):
+    """
+    SM-2 update of a card after a review
+    :param ease: Ease factor before the review
+    :param interval: Interval in days before the review
+    :param repetitions: Number of successful reviews in a row before this one
+    :param grade: Score of the review, 0 to 5
+    :return: (ease, interval in days, repetitions) after the review
+    """
+    grade = min(max(grade, 0), 5)
+    if grade < PASSING_GRADE:
+        repetitions, interval = 0, 1.0
+    else:
+        repetitions += 1
+        interval = 1.0 if repetitions == 1 else 6.0 if repetitions == 2 else round(interval * ease)
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+    return ease, interval, repetitions
+
+
+def _review_time(attempt):
+    try:
+        return datetime.fromisoformat(attempt["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+
+def apply_attempts(conn, note_title, attempts):
+    """
+    Reschedules the cards of the questions answered in attempts saved after the note's view position
+    :param conn: Connection of the stats views, inside their transaction
+    :param note_title: Note title
+    :param attempts: Saved attempts, in storage order
+    """
+    for attempt in attempts:
+        grade = parse_score(attempt.get("score"))
+        if grade is None or not attempt.get("question"):
+            continue
+        card_id = question_hash(note_title, attempt["question"])
+        row = conn.execute("SELECT ease, interval, repetitions FROM cards WHERE card_id = ?", (card_id,)).fetchone()
+        ease, interval, repetitions = sm2(*(row or (INITIAL_EASE, 0.0, 0)), grade)
+        reviewed_at = _review_time(attempt)
+        conn.execute(
+            "INSERT OR REPLACE INTO cards (card_id, note_title, question, correct_answer, ease, interval, repetitions, "
+            "due, last_review, last_score) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (card_id, note_title, attempt["question"], attempt.get("correct_answer"), ease, interval, repetitions,
+             reviewed_at + interval * SECONDS_PER_DAY, reviewed_at, grade),
+        )
+
+
+def drop_note(conn, note_title):
+    conn.execute("DELETE FROM cards WHERE note_title = ?", (note_title,))
+
+
+def drop_all(conn):
+    conn.execute("DELETE FROM cards")
+
+
+def get_due_cards(limit=20, note_title=None, now=None):
+    """
+    Lists the cards due for review, most overdue first, reading only them through the due index
+    :param limit: Maximum number of cards
+    :param note_title: Only the cards of this note, None for every note
+    :param now: Reference time in epoch seconds, defaults to the current time
+    :return: List of cards (card_id, note_title, question, correct_answer, ease, interval, repetitions,
+             due, last_review, last_score)
+    """
+    now = time.time() if now is None else now
+    query = f"SELECT {', '.join(CARD_FIELDS)} FROM cards WHERE "
+    params = []
+    if note_title is not None:
+        query += "note_title = ? AND "
+        params.append(note_title)
+    rows = stats_views.connection().execute(query + "due <= ? ORDER BY due LIMIT ?", params + [now, limit])
+    return [dict(zip(CARD_FIELDS, row)) for row in rows]
+
+
+def get_due_questions(note_title=None, limit=20, include_new=True):
+    """
+    Assembles a review session: the due questions first, then those of the note never answered yet
+    :param note_title: Only the questions of this note, None for every note
+    :param limit: Maximum number of questions
+    :param include_new: Complete the session with unanswered questions of the note
+    :return: List of questions ({text, reponse, note_title, card}), card being None for new questions
+    """
+    questions = [
+        {"text": card["question"], "reponse": card["correct_answer"], "note_title": card["note_title"], "card": card}
+        for card in get_due_cards(limit, note_title)
+    ]
+    if include_new and note_title is not None and len(questions) < limit:
+        conn = stats_views.connection()
+        reviewed = {card_id for (card_id,) in conn.execute("SELECT card_id FROM cards WHERE note_title = ?", (note_title,))}
+        for question in get_storage().read_questions(note_title) or []:
+            if len(questions) >= limit:
+                break
+            if question_hash(note_title, question.get("text", "")) not in reviewed:
+                questions.append({"text": question.get("text"), "reponse": question.get("reponse"),
+                                  "note_title": note_title, "card": None})
+    return questions
+
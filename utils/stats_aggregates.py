@@ -0,0 +1,106 @@
+import json
+import logging
+from config import STATS_LAST_N
+from utils import stats_views
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS note_stats (
+    note_title TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    min_score REAL NOT NULL,
+    max_score REAL NOT NULL,
+    last_scores TEXT NOT NULL,
+    last_timestamp TEXT
+);
+"""
+
+
+def parse_score(value):
+    """
+    Scores were saved as ints or as strings ("3", "4.5") depending on the client
+    :return: The score as a float, None if it is not a number
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _add(conn, note_title, scores, timestamp):
+    """
+    Folds scores, in storage order, into the running aggregates of a note
+    """
+    if not scores:
+        return
+    row = conn.execute(
+        "SELECT count, total, min_score, max_score, last_scores, last_timestamp FROM note_stats WHERE note_title = ?",
+        (note_title,),
+    ).fetchone()
+    if row is None:
+        count, total, min_score, max_score, last_scores, last_timestamp = 0, 0.0, min(scores), max(scores), [], None
+    else:
+        count, total, min_score, max_score, last_scores, last_timestamp = row[0], row[1], row[2], row[3], json.loads(row[4]), row[5]
+    last_scores = (last_scores + scores)[-STATS_LAST_N:]
+    # A late attempt (e.g. replayed after a crash) does not move the last attempt time back
+    if last_timestamp is not None and (timestamp is None or timestamp < last_timestamp):
+        timestamp = last_timestamp
+    conn.execute(
+        "INSERT OR REPLACE INTO note_stats (note_title, count, total, min_score, max_score, last_scores, last_timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (note_title, count + len(scores), total + sum(scores), min(min_score, *scores), max(max_score, *scores),
+         json.dumps(last_scores), timestamp),
+    )
+
+
+def apply_attempts(conn, note_title, attempts):
+    """
+    Updates the aggregates of a note with attempts saved after its view position
+    :param conn: Connection of the stats views, inside their transaction
+    :param note_title: Note title
+    :param attempts: Saved attempts (timestamp, question, user_answer, correct_answer, score), in storage order
+    """
+    scores = []
+    for attempt in attempts:
+        score = parse_score(attempt.get("score"))
+        if score is None:
+            logging.warning("Attempt on %s saved with a non-numeric score: %r", note_title, attempt.get("score"))
+        else:
+            scores.append(score)
+    timestamps = [attempt["timestamp"] for attempt in attempts if attempt.get("timestamp")]
+    _add(conn, note_title, scores, max(timestamps) if timestamps else None)
+
+
+def drop_note(conn, note_title):
+    conn.execute("DELETE FROM note_stats WHERE note_title = ?", (note_title,))
+
+
+def drop_all(conn):
+    conn.execute("DELETE FROM note_stats")
+
+
+def get_summary():
+    """
+    Reads the per-note aggregates without touching the attempt history
+    :return: Dictionary with the count, average, min, max, last scores and last attempt time of
+             each note, and the overall count and average
+    """
+    conn = stats_views.connection()
+    notes = {}
+    count, total = 0, 0.0
+    rows = conn.execute(
+        "SELECT note_title, count, total, min_score, max_score, last_scores, last_timestamp FROM note_stats "
+        "ORDER BY note_title"
+    )
+    for note_title, note_count, note_total, min_score, max_score, last_scores, last_timestamp in rows:
+        notes[note_title] = {
+            "count": note_count,
+            "average": note_total / note_count,
+            "min": min_score,
+            "max": max_score,
+            "last_scores": json.loads(last_scores),
+            "last_attempt": last_timestamp,
+        }
+        count += note_count
+        total += note_total
+    return {"notes": notes, "overall": {"count": count, "average": total / count if count else None}}
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from storage import get_storage
+from utils.stats_aggregates import parse_score
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+
+NPZ, PARQUET = "npz", "parquet"
+_SEPARATOR = "\x00"
+
+
+def _read_attempts(since, upto):
+    """
+    :param since: Sequence number of a previous export, only the attempts saved after it are read
+    :param upto: Last sequence number to read, fixed before reading so that all notes are read at the same point
+    :return: List of (note title, attempt) in storage order within each note
+    """
+    storage = get_storage()
+    rows = []
+    for note_title in sorted(storage.list_stats_notes()):
+        rows.extend((note_title, attempt) for attempt in storage.read_attempts_after(note_title, since, upto))
+    return rows
+
+
+def _dictionary_encode(values):
+    """
+    :return: (int32 codes, distinct values in order of first appearance)
+    """
+    dictionary = {}
+    codes = np.fromiter((dictionary.setdefault(value, len(dictionary)) for value in values), dtype=np.int32, count=len(values))
+    return codes, list(dictionary)
+
+
+def _pack_strings(values):
+    """
+    Stores strings as one UTF-8 buffer with a separator, which NumPy saves without pickling
+    """
+    return np.frombuffer(_SEPARATOR.join(value.replace(_SEPARATOR, " ") for value in values).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(data, count):
+    return data.tobytes().decode("utf-8").split(_SEPARATOR) if count else []
+
+
+def _columns(rows):
+    timestamps = np.array([attempt.get("timestamp") or "NaT" for _, attempt in rows], dtype="datetime64[us]")
+    scores = np.array([parse_score(attempt.get("score")) for _, attempt in rows], dtype=np.float32)
+    return {
+        "note": _dictionary_encode([note_title for note_title, _ in rows]),
+        "question": _dictionary_encode([str(attempt.get("question") or "") for _, attempt in rows]),
+        "correct_answer": _dictionary_encode([str(attempt.get("correct_answer") or "") for _, attempt in rows]),
+        "user_answer": [str(attempt.get("user_answer") or "") for _, attempt in rows],
+        "timestamp": timestamps,
+        "score": scores,
+    }
+
+
+def _write_npz(path, columns, watermark):
+    arrays = {"timestamp": columns["timestamp"], "score": columns["score"], "watermark": np.array(watermark or "")}
+    for name in ("note", "question", "correct_answer"):
+        codes, values = columns[name]
+        arrays[f"{name}_codes"] = codes
+        arrays[f"{name}_values"] = _pack_strings(values)
+        arrays[f"{name}_count"] = np.array(len(values))
+    arrays["user_answer"] = _pack_strings(columns["user_answer"])
+    with open(path, "wb") as file:
+        np.savez_compressed(file, **arrays)
+
+
+def _write_parquet(path, columns, watermark):
+    def dictionary(name):
+        codes, values = columns[name]
+        return pa.DictionaryArray.from_arrays(pa.array(codes, pa.int32()), pa.array(values, pa.string()))
+
+    table = pa.table({
+        "note": dictionary("note"),
+        "question": dictionary("question"),
+        "correct_answer": dictionary("correct_answer"),
+        "user_answer": pa.array(columns["user_answer"], pa.string()),
+        "timestamp": pa.array(columns["timestamp"], pa.timestamp("us")),
+        "score": pa.array(columns["score"], pa.float32(), from_pandas=True),
+    }).replace_schema_metadata({"watermark": watermark or ""})
+    pq.write_table(table, path, compression="zstd")
+
+
+def export_attempts(path, since=None, file_format=NPZ):
+    """
+    Writes the quiz attempts to a columnar file: note, question and correct answer are dictionary
+    encoded, timestamps are datetime64[us] and scores float32 (NaN when not numeric)
+    :param path: Output file
+    :param since: Watermark returned by a previous export to only write the attempts saved after it.
+                  It is a storage sequence number, so attempts saved late (e.g. replayed after a
+                  crash) are exported even if their timestamp is older than the previous export.
+    :param file_format: NPZ, or PARQUET when pyarrow is installed
+    :return: Dictionary with the number of attempts, the watermark to pass to the next export and the file size
+    """
+    if file_format == PARQUET and pa is None:
+        raise ValueError("Parquet export requires pyarrow")
+    if file_format not in (NPZ, PARQUET):
+        raise ValueError(f"Unknown export format: {file_format}")
+    if since is not None and not str(since).isdigit():
+        raise ValueError(f"Invalid export watermark: {since}")
+    since = int(since) if since is not None else None
+    upto = get_storage().last_attempt_seq()
+    rows = _read_attempts(since, upto)
+    watermark = str(max(upto, since or 0))
+    columns = _columns(rows)
+    if file_format == PARQUET:
+        _write_parquet(path, columns, watermark)
+    else:
+        _write_npz(path, columns, watermark)
+    return {"attempts": len(rows), "watermark": watermark, "format": file_format, "bytes": os.path.getsize(path)}
+
+
+def load_export(path):
+    """
+    Reads a .npz export back
+    :return: Dictionary of columns: note, question and correct_answer as (codes, values), user_answer
+             as a list, timestamp, score and the export watermark
+    """
+    with np.load(path) as data:
+        columns = {name: (data[f"{name}_codes"], _unpack_strings(data[f"{name}_values"], int(data[f"{name}_count"])))
+                   for name in ("note", "question", "correct_answer")}
+        columns["user_answer"] = _unpack_strings(data["user_answer"], len(data["timestamp"]))
+        columns["timestamp"] = data["timestamp"]
+        columns["score"] = data["score"]
+        columns["watermark"] = str(data["watermark"]) or None
+    return columns
@@ -1,72 +1,121 @@
-import os
-import json
 from datetime import datetime
-from config import STATS_DIR
+from storage import get_storage
+from config import STATS_COMPACTION_INTERVAL, STATS_WAL_DIR, STATS_GROUP_COMMIT_INTERVAL
+from utils import stats_aggregates, stats_views
+from utils.group_commit import GroupCommitWriter
+import threading
 import logging
+import uuid
+
+_compactor = {"thread": None, "stopping": threading.Event()}
+
+def _persist_attempts(note_title, attempts, retry=False):
+    """
+    Writes a batch of attempts of a note to the storage, then to the stats views (summary, review
+    schedule and question statistics)
+    :param retry: The batch may have been partly saved by an interrupted write
+    """
+    storage = get_storage()
+    if retry:
+        attempts = storage.unsaved_attempts(note_title, attempts)
+        if not attempts:
+            return
+    storage.append_attempts(note_title, attempts)
+    try:
+        stats_views.sync_note(note_title)
+    except Exception as e:
+        # The attempts are saved, the views catch up from their position on the next reconciliation
+        logging.error(f"Error updating the stats views of {note_title}: {e}")
+        stats_views.request_reconcile()
+
+attempt_writer = GroupCommitWriter(STATS_WAL_DIR, _persist_attempts, interval=STATS_GROUP_COMMIT_INTERVAL)
 
 def save_quiz_result(note_title, question_text, user_answer, correct_answer, score):
     """
     Save the result of a quiz question
     """
-    if not os.path.exists(STATS_DIR):
-        os.makedirs(STATS_DIR)
-        
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
-    
-    # Load existing stats or create a new dictionary
-    if os.path.exists(stats_file):
-        with open(stats_file, 'r') as f:
-            stats = json.load(f)
-    else:
-        stats = {"attempts": []}
-    
-    # Add new attempt
-    attempt = {
-        "timestamp": datetime.now().isoformat(),
+    save_quiz_results(note_title, [{
         "question": question_text,
         "user_answer": user_answer,
         "correct_answer": correct_answer,
         "score": score
-    }
-    
-    stats["attempts"].append(attempt)
-    
-    # Sauvegarder les stats
-    with open(stats_file, 'w') as f:
-        json.dump(stats, f, indent=4, ensure_ascii=False)
+    }])
+
+def save_quiz_results(note_title, results):
+    """
+    Save the results of a quiz submission in one write. Results saved by concurrent requests are
+    grouped too, within STATS_GROUP_COMMIT_INTERVAL seconds, and logged to the write-ahead log
+    before being written.
+    :param note_title: Note title
+    :param results: List of {question, user_answer, correct_answer, score}
+    :return: Number of results saved
+    :raise ValueError: If the note title cannot be stored
+    :raise concurrent.futures.TimeoutError: If the results are not saved in time; they may still be saved later
+    """
+    timestamp = datetime.now().isoformat()
+    attempts = [{
+        # Identifies the attempt when a write is replayed, so that it is not saved twice
+        "id": uuid.uuid4().hex,
+        "timestamp": timestamp,
+        "question": result["question"],
+        "user_answer": result["user_answer"],
+        "correct_answer": result["correct_answer"],
+        "score": result["score"]
+    } for result in results]
+    return attempt_writer.submit(note_title, attempts)
 
 def get_note_stats(note_title):
     """
     Retrieves statistics for a given note
     """
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
-    if os.path.exists(stats_file):
-        with open(stats_file, 'r') as f:
-            return json.load(f)
-    return {"attempts": []}
+    return {"attempts": get_storage().read_attempts(note_title)}
 
 def get_all_stats():
     """
     Retrieves all statistics
     """
+    storage = get_storage()
     all_stats = {}
-    if os.path.exists(STATS_DIR):
-        for filename in os.listdir(STATS_DIR):
-            if filename.endswith('_stats.json'):
-                note_title = filename.replace('_stats.json', '')
-                with open(os.path.join(STATS_DIR, filename), 'r') as f:
-                    all_stats[note_title] = json.load(f)
+    for note_title in storage.list_stats_notes():
+        all_stats[note_title] = {"attempts": storage.read_attempts(note_title)}
     return all_stats
 
+def _timestamp_bound(value):
+    """
+    Attempts are timestamped in the server's local time, without timezone
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.isoformat()
+
+def get_note_attempts(note_title, limit=20, cursor=None, since=None, until=None):
+    """
+    Retrieves a page of the attempts of a note, newest first
+    :param limit: Maximum number of attempts to return
+    :param cursor: Cursor returned with the previous page, None for the newest attempts
+    :param since: Only attempts at or after this datetime
+    :param until: Only attempts before this datetime
+    :return: Dictionary with the attempts and the cursor of the next page
+    :raise ValueError: If the cursor is invalid
+    """
+    return get_storage().read_attempts_page(note_title, limit, cursor, _timestamp_bound(since), _timestamp_bound(until))
+
+def get_stats_summary():
+    """
+    Retrieves the running score aggregates of every note, without reading the attempt history
+    """
+    return stats_aggregates.get_summary()
+
 def delete_note_stats(note_title):
     """
     Delete stats history for a given note
     """
-    stats_file = os.path.join(STATS_DIR, f"{note_title}_stats.json")
     try:
-        if os.path.exists(stats_file):
-            os.remove(stats_file)
-            return True
+        deleted = get_storage().delete_stats(note_title)
+        stats_views.remove_note(note_title)
+        return deleted
     except Exception as e:
         logging.error(f"Error deleting stats from {note_title}: {e}")
     return False
@@ -76,11 +125,46 @@ def delete_all_stats():
     Supprime tout l'historique des stats
     """
     try:
-        if os.path.exists(STATS_DIR):
-            for filename in os.listdir(STATS_DIR):
-                if filename.endswith('_stats.json'):
-                    os.remove(os.path.join(STATS_DIR, filename))
-            return True
+        get_storage().delete_all_stats()
+        stats_views.clear()
+        return True
     except Exception as e:
         logging.error(f"Error deleting all stats: {e}")
-    return False 
\ No newline at end of file
+    return False
+
+def compact_stats():
+    """
+    Folds the attempts appended since the last compaction into the per-note logs
+    :return: Number of attempts compacted
+    """
+    try:
+        return get_storage().compact_attempts()
+    except Exception as e:
+        logging.error(f"Error compacting stats: {e}")
+    return 0
+
+def _run_compactor(interval):
+    while not _compactor["stopping"].wait(interval):
+        compact_stats()
+
+def start_compactor(interval=STATS_COMPACTION_INTERVAL):
+    """
+    Starts compacting the stats every interval seconds in a background thread
+    """
+    if _compactor["thread"] is not None or interval <= 0:
+        return
+    _compactor["stopping"].clear()
+    _compactor["thread"] = threading.Thread(target=_run_compactor, args=(interval,), name="stats-compactor", daemon=True)
+    _compactor["thread"].start()
+
+def stop_compactor(timeout=5):
+    """
+    Stops the background compaction after a last pass
+    """
+    thread = _compactor["thread"]
+    if thread is None:
+        return
+    _compactor["stopping"].set()
+    thread.join(timeout)
+    _compactor["thread"] = None
+    compact_stats()
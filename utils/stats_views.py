@@ -0,0 +1,168 @@
+import logging
+import threading
+from config import STATS_VIEWS_PATH, STATS_VIEWS_RECONCILE_INTERVAL
+from storage import get_storage
+from storage.sqlite import ThreadLocalConnections
+
+# Views derived from the attempt history share one database and one position per note: the
+# sequence number of the last attempt applied to all of them. Each view module provides SCHEMA,
+# apply_attempts(conn, note_title, attempts), drop_note(conn, note_title) and drop_all(conn).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS view_positions (
+    note_title TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_db = None
+_db_lock = threading.Lock()
+_reconcile_lock = threading.Lock()
+_state = {"reconciled": False, "thread": None, "wake": threading.Event(), "stopping": False}
+
+
+def _views():
+    # Imported here because the view modules read their tables through this one
+    from utils import stats_aggregates, spaced_repetition, question_difficulty
+    return {"summary": stats_aggregates, "reviews": spaced_repetition, "questions": question_difficulty}
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                db = ThreadLocalConnections(STATS_VIEWS_PATH, SCHEMA + "".join(view.SCHEMA for view in _views().values()))
+                _check_views(db)
+                _db = db
+    return _db
+
+
+def _check_views(db):
+    """
+    The positions are shared: when the set of views changes, every view is built again from the start
+    """
+    names = ",".join(sorted(_views()))
+    with db.transaction() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'views'").fetchone()
+        if row is None or row[0] != names:
+            _drop_all(conn)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('views', ?)", (names,))
+
+
+def _drop_all(conn):
+    for view in _views().values():
+        view.drop_all(conn)
+    conn.execute("DELETE FROM view_positions")
+
+
+def sync_note(note_title):
+    """
+    Applies to every view the attempts of a note saved after its position, then moves the position.
+    Both are committed together, so concurrent workers never apply an attempt twice and a failed
+    update is caught up by the next sync of the note.
+    :param note_title: Note title
+    :return: Number of attempts applied
+    """
+    storage = get_storage()
+    with _get_db().transaction() as conn:
+        row = conn.execute("SELECT seq FROM view_positions WHERE note_title = ?", (note_title,)).fetchone()
+        attempts = storage.read_attempts_after(note_title, row[0] if row else None)
+        if not attempts:
+            return 0
+        for view in _views().values():
+            view.apply_attempts(conn, note_title, attempts)
+        seq = max(attempt.get("seq", 0) for attempt in attempts)
+        conn.execute("INSERT OR REPLACE INTO view_positions (note_title, seq) VALUES (?, ?)", (note_title, seq))
+    return len(attempts)
+
+
+def remove_note(note_title):
+    """
+    Drops a note from every view after its history was deleted
+    """
+    with _get_db().transaction() as conn:
+        for view in _views().values():
+            view.drop_note(conn, note_title)
+        conn.execute("DELETE FROM view_positions WHERE note_title = ?", (note_title,))
+
+
+def clear():
+    """
+    Empties every view after the whole history was deleted
+    """
+    with _get_db().transaction() as conn:
+        _drop_all(conn)
+
+
+def reconcile():
+    """
+    Brings every view in line with the storage: applies the attempts saved since each note's
+    position (all of them the first time) and drops the notes whose history no longer exists
+    :return: Dictionary with the number of attempts applied and of notes dropped
+    """
+    with _reconcile_lock:
+        storage = get_storage()
+        counts = {"applied": 0, "dropped": 0}
+        titles = set(storage.list_stats_notes())
+        for note_title in titles:
+            counts["applied"] += sync_note(note_title)
+        positions = [note_title for (note_title,) in _get_db().get().execute("SELECT note_title FROM view_positions")]
+        for note_title in set(positions) - titles:
+            remove_note(note_title)
+            counts["dropped"] += 1
+        _state["reconciled"] = True
+    if counts["applied"] or counts["dropped"]:
+        logging.info("Stats views reconciled: %s", counts)
+    return counts
+
+
+def connection():
+    """
+    :return: Connection to read the views, once they were reconciled in this process
+    """
+    if not _state["reconciled"]:
+        reconcile()
+    return _get_db().get()
+
+
+def request_reconcile():
+    """
+    Asks the background reconciliation for a pass, e.g. after a failed sync
+    """
+    _state["wake"].set()
+
+
+def _run_reconciler(interval):
+    while not _state["stopping"]:
+        try:
+            reconcile()
+        except Exception as e:
+            logging.error("Error reconciling the stats views : %s", e)
+        _state["wake"].wait(interval)
+        _state["wake"].clear()
+
+
+def start_reconciler(interval=STATS_VIEWS_RECONCILE_INTERVAL):
+    """
+    Reconciles the views at startup, then every interval seconds and whenever a sync failed
+    """
+    if _state["thread"] is not None:
+        return
+    _state["stopping"] = False
+    _state["thread"] = threading.Thread(target=_run_reconciler, args=(interval,), name="stats-views", daemon=True)
+    _state["thread"].start()
+
+
+def stop_reconciler(timeout=5):
+    thread = _state["thread"]
+    if thread is None:
+        return
+    _state["stopping"] = True
+    _state["wake"].set()
+    thread.join(timeout)
+    _state["thread"] = None
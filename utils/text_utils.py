@@ -0,0 +1,54 @@
+import re
+import hashlib
+import unicodedata
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def fold_accents(text):
+    """
+    Lowercases text and strips accents so that "Réseaux" and "reseaux" compare equal
+    :param text: Text to fold
+    :return: Folded text
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    """
+    Splits text into accent-folded word tokens
+    :param text: Text to tokenize
+    :return: List of tokens
+    """
+    return _TOKEN_RE.findall(fold_accents(text))
+
+
+def iter_token_spans(text):
+    """
+    Yields the folded form of each word of text along with its position in the original text
+    :param text: Original text
+    :return: Generator of (token, start, end)
+    """
+    for match in _TOKEN_RE.finditer(text):
+        yield fold_accents(match.group()), match.start(), match.end()
+
+
+def normalize_answer(text):
+    """
+    Canonical form of a free-text answer: Unicode NFKC, case-folded, whitespace collapsed
+    :param text: Answer text
+    :return: Normalized text
+    """
+    return " ".join(unicodedata.normalize("NFKC", text or "").casefold().split())
+
+
+def question_hash(note_title, question):
+    """
+    Stable identity of a question of a note, insensitive to case and spacing changes
+    :param note_title: Title of the note the question was generated from
+    :param question: Question text
+    :return: 16 hex characters
+    """
+    key = f"{note_title}\n{normalize_answer(question)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]